@@ -0,0 +1,447 @@
+import asyncio
+import random
+import struct
+import DnsQuery as query
+import DnsResponse as response
+import DnsRtt as rtt_estimation
+import DnsTransport as transport
+
+# maximum number of idle TCP connections kept alive to the server
+MAX_IDLE_TCP_CONNECTIONS = 4
+
+# maximum delay before a raced query is also sent to the next server, in seconds
+MAX_STAGGER_DELAY = 0.2
+
+# response codes (server failure, refused) after which a race waits on the other
+# servers, whose responses are likely to be better
+RETRY_RCODES = (2, 5)
+
+
+class DnsClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        """
+        Initializes the datagram protocol shared by all in-flight queries:
+        - transport: The UDP transport, set once the endpoint is created
+        - pending: Maps each in-flight transaction ID to the future awaiting its
+          response and to the encoded question it was sent with
+        """
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        """
+        Demultiplexes a response to the query waiting on its transaction ID.
+        Responses that are too short, match no pending query or whose question
+        section differs from the one sent are dropped.
+        """
+        if len(data) < 12:
+            return
+
+        transaction_id = struct.unpack(">H", data[:2])[0]
+        future, question = self.pending.get(transaction_id, (None, None))
+        if future is None or future.done():
+            return
+
+        # the question section directly follows the 12-byte header
+        if data[12 : 12 + len(question)].lower() != question.lower():
+            return
+
+        future.set_result(data)
+
+    def error_received(self, error):
+        # ICMP errors (e.g. port unreachable) are not tied to a single query,
+        # the per-query timers take care of retransmitting
+        pass
+
+    def connection_lost(self, error):
+        # fail every query still waiting for a response
+        for future, _ in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("DNS socket closed"))
+
+
+class AsyncDnsResolver:
+    def __init__(
+        self,
+        dns_server,
+        port=53,
+        timeout=5,
+        max_retries=3,
+        max_in_flight=1000,
+        cache=None,
+        rtt=None,
+        edns_payload_size=None,
+        recursion_desired=True,
+    ):
+        """
+        Initializes an asyncio DNS resolver with:
+        - dns_server: IPv4 address of the DNS server
+        - port: UDP port of the DNS server
+        - timeout: Seconds to wait for a response before retransmitting
+        - max_retries: Maximum number of times a query is sent before giving up
+        - max_in_flight: Maximum number of queries awaiting a response at once
+        - cache: Optional DnsCache answering repeated questions without a query
+        - rtt: Optional RttTable, each attempt then waits for the server's adaptive
+          timeout with exponential backoff, timeout only being the upper bound
+        - edns_payload_size: Optional UDP payload size advertised with EDNS0
+        - recursion_desired: Whether queries set the RD flag, cleared to query
+          authoritative servers iteratively
+        Truncated UDP responses are queried again over kept-alive TCP connections.
+        """
+        self.dns_server = dns_server
+        self.port = port
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.cache = cache
+        self.rtt = rtt
+        self.edns_payload_size = edns_payload_size
+        self.recursion_desired = recursion_desired
+
+        self.transport = None
+        self.protocol = None
+        self.tcp_idle = []  # idle (reader, writer) TCP connections to the server
+
+        # queries in flight by question, as [task, number of callers waiting on it]
+        self.in_flight = {}
+        self.coalesced = 0  # number of queries answered by an identical one in flight
+
+    async def open(self):
+        """
+        Creates the single UDP endpoint used by every query
+        """
+        loop = asyncio.get_running_loop()
+        self.transport, self.protocol = await loop.create_datagram_endpoint(
+            DnsClientProtocol, remote_addr=(self.dns_server, self.port)
+        )
+        return self
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+        for _, writer in self.tcp_idle:
+            writer.close()
+        self.tcp_idle.clear()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def new_transaction_id(self):
+        """
+        Picks a random 16-bit transaction ID that is not already in flight
+        """
+        while True:
+            transaction_id = random.randint(0, 65535)
+            if transaction_id not in self.protocol.pending:
+                return transaction_id
+
+    async def tcp_exchange(self, reader, writer, query_packet):
+        """
+        Sends a query over a TCP connection (with its 2-byte length prefix)
+        and returns the response with the same transaction ID
+        """
+        writer.write(struct.pack(">H", len(query_packet)) + query_packet)
+        await writer.drain()
+
+        while True:
+            try:
+                length = struct.unpack(">H", await reader.readexactly(2))[0]
+                raw_response = await reader.readexactly(length)
+            except asyncio.IncompleteReadError:
+                raise ConnectionResetError("Connection closed by the DNS server")
+            if raw_response[:2] == query_packet[:2]:
+                return raw_response
+
+    async def query_tcp(self, query_packet):
+        """
+        Sends a query over an idle TCP connection to the server if there is one,
+        otherwise (or if the server closed the idle connection) over a new one,
+        and keeps the connection alive for the next queries
+        """
+        if self.tcp_idle:
+            reader, writer = self.tcp_idle.pop()
+            try:
+                raw_response = await asyncio.wait_for(
+                    self.tcp_exchange(reader, writer, query_packet), self.timeout
+                )
+                self.release_tcp(reader, writer)
+                return raw_response
+            except ConnectionError:
+                writer.close()  # idle connection closed by the server, use a new one
+            except BaseException:
+                writer.close()
+                raise
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.dns_server, self.port), self.timeout
+        )
+        try:
+            raw_response = await asyncio.wait_for(
+                self.tcp_exchange(reader, writer, query_packet), self.timeout
+            )
+        except BaseException:
+            writer.close()
+            raise
+        self.release_tcp(reader, writer)
+        return raw_response
+
+    def release_tcp(self, reader, writer):
+        # keep the connection alive for the next truncated responses
+        not_full = len(self.tcp_idle) < MAX_IDLE_TCP_CONNECTIONS
+        if self.transport is not None and not_full:
+            self.tcp_idle.append((reader, writer))
+        else:
+            writer.close()
+
+    async def query(self, domain, qtype, qclass=0x0001):
+        """
+        Sends a query and waits for its response, retransmitting on timeout.
+        Returns the parsed DnsResponse and the number of retries used,
+        raises TimeoutError once max_retries attempts went unanswered.
+        Concurrent identical queries share a single query in flight, its
+        response (or error) being returned to every caller.
+        """
+        # serve cache hits without building or sending a packet
+        if self.cache is not None:
+            cached_response = self.cache.get(domain, qtype, qclass)
+            if cached_response is not None:
+                return cached_response, 0
+
+        # attach to the identical query in flight, or send a new one
+        key = (domain.lower().rstrip("."), qtype, qclass)
+        entry = self.in_flight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(self.send_query(domain, qtype, qclass))
+            entry = [task, 0]
+            self.in_flight[key] = entry
+            task.add_done_callback(lambda _: self.forget_query(key, entry))
+        else:
+            self.coalesced += 1
+
+        entry[1] += 1
+        try:
+            # shield the shared query so one caller being cancelled
+            # does not cancel it for the others
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                # no caller waits for the response anymore, stop retransmitting
+                self.forget_query(key, entry)
+                entry[0].cancel()
+
+    def forget_query(self, key, entry):
+        # later identical queries are sent anew
+        if self.in_flight.get(key) is entry:
+            del self.in_flight[key]
+
+    async def send_query(self, domain, qtype, qclass):
+        """
+        Sends a query, retransmitting on timeout, and caches its response
+        """
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+
+            # build the query packet once with an ID that is not in flight
+            dns_query = query.DnsQuery(domain, qtype, qclass, self.edns_payload_size)
+            dns_query.header.id = self.new_transaction_id()
+            dns_query.header.rd = int(self.recursion_desired)
+            query_packet = dns_query.build()
+
+            future = loop.create_future()
+            self.protocol.pending[dns_query.header.id] = (
+                future,
+                dns_query.question.build(),
+            )
+
+            estimator = None
+            if self.rtt is not None:
+                estimator = self.rtt.get(self.dns_server, self.port)
+
+            try:
+                for attempt in range(self.max_retries):
+                    self.transport.sendto(query_packet)
+                    sent_at = loop.time()
+                    if estimator is None:
+                        attempt_timeout = self.timeout
+                    else:
+                        attempt_timeout = estimator.timeout(attempt, self.timeout)
+                    try:
+                        # shield the future so a timeout only cancels this wait
+                        raw_response = await asyncio.wait_for(
+                            asyncio.shield(future), attempt_timeout
+                        )
+                    except asyncio.TimeoutError:
+                        continue
+
+                    # only a response to a query sent once is an RTT sample
+                    if estimator is not None and attempt == 0:
+                        estimator.update(loop.time() - sent_at)
+
+                    # the answer did not fit in a UDP response, fall back to TCP
+                    if transport.is_truncated(raw_response):
+                        raw_response = await self.query_tcp(query_packet)
+
+                    dns_response = response.DnsResponse(raw_response)
+                    if self.cache is not None:
+                        self.cache.put(domain, qtype, qclass, dns_response)
+                    return dns_response, attempt
+
+                raise TimeoutError(
+                    f"Maximum number of retries {self.max_retries} exceeded"
+                )
+            finally:
+                del self.protocol.pending[dns_query.header.id]
+                future.cancel()
+
+
+class RacingResolver:
+    def __init__(
+        self,
+        dns_servers,
+        port=53,
+        timeout=5,
+        max_retries=3,
+        max_in_flight=1000,
+        cache=None,
+        rtt=None,
+        edns_payload_size=None,
+        stagger_delay=MAX_STAGGER_DELAY,
+    ):
+        """
+        Initializes a resolver racing queries across several DNS servers with:
+        - resolvers: Maps each DNS server to its AsyncDnsResolver
+        - rtt: RttTable shared by the resolvers, scoring the health of each server
+        - stagger_delay: Maximum delay before a query is also sent to the next server
+        The other arguments are those of AsyncDnsResolver, the cache being
+        shared by all servers.
+        """
+        self.port = port
+        self.cache = cache
+        self.rtt = rtt if rtt is not None else rtt_estimation.RttTable()
+        self.stagger_delay = stagger_delay
+        self.resolvers = {
+            dns_server: AsyncDnsResolver(
+                dns_server,
+                port,
+                timeout,
+                max_retries,
+                max_in_flight,
+                None,
+                self.rtt,
+                edns_payload_size,
+            )
+            for dns_server in dns_servers
+        }
+
+    async def open(self):
+        await asyncio.gather(*(resolver.open() for resolver in self.resolvers.values()))
+        return self
+
+    def close(self):
+        for resolver in self.resolvers.values():
+            resolver.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def coalesced(self):
+        # queries to any server answered by an identical one in flight
+        return sum(resolver.coalesced for resolver in self.resolvers.values())
+
+    def ranked_servers(self):
+        """
+        Returns the servers from the healthiest to the least healthy,
+        servers with the same score keeping the order they were given in
+        """
+        return sorted(
+            self.resolvers, key=lambda server: self.rtt.get(server, self.port).score()
+        )
+
+    def stagger(self, dns_server):
+        # wait for the server about as long as it usually takes to respond
+        estimator = self.rtt.get(dns_server, self.port)
+        return estimator.timeout(0, self.stagger_delay)
+
+    async def race(self, domain, qtype, qclass=0x0001):
+        """
+        Sends the query to the healthiest server first, then to the next server
+        each time its stagger delay passes (or the last server failed) without
+        a valid response. Returns the first valid DnsResponse, the number of
+        retries it took and the server that sent it (None for a cache hit).
+        The queries still in flight to the other servers are cancelled, so
+        their late responses are dropped. Raises the last error once every
+        server failed, unless one of them answered with a server error.
+        """
+        if self.cache is not None:
+            cached_response = self.cache.get(domain, qtype, qclass)
+            if cached_response is not None:
+                return cached_response, 0, None
+
+        remaining = self.ranked_servers()
+        in_flight = {}  # task of each server queried, to its server
+        last_error = TimeoutError("No DNS server to query")
+        server_error = None  # (dns_response, retries, server) of a server error
+
+        try:
+            while remaining or in_flight:
+                # send a duplicate query to the next server
+                delay = None
+                if remaining:
+                    dns_server = remaining.pop(0)
+                    resolver = self.resolvers[dns_server]
+                    task = asyncio.create_task(resolver.query(domain, qtype, qclass))
+                    in_flight[task] = dns_server
+                    if remaining:
+                        delay = self.stagger(dns_server)
+
+                done, _ = await asyncio.wait(
+                    in_flight, timeout=delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    dns_server = in_flight.pop(task)
+                    estimator = self.rtt.get(dns_server, self.port)
+                    try:
+                        dns_response, retries = task.result()
+                    except (TimeoutError, ConnectionError, ValueError) as error:
+                        estimator.failed()
+                        last_error = error
+                        continue
+
+                    if dns_response.header.rcode in RETRY_RCODES:
+                        estimator.failed()
+                        server_error = (dns_response, retries, dns_server)
+                        continue
+
+                    if self.cache is not None:
+                        self.cache.put(domain, qtype, qclass, dns_response)
+                    return dns_response, retries, dns_server
+        finally:
+            # the losing queries stop retransmitting and drop their late responses
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+        if server_error is not None:
+            return server_error
+        raise last_error
+
+    async def query(self, domain, qtype, qclass=0x0001):
+        """
+        Races the query across the servers.
+        Returns the first valid DnsResponse and the number of retries it took.
+        """
+        dns_response, retries, _ = await self.race(domain, qtype, qclass)
+        return dns_response, retries
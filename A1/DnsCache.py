@@ -0,0 +1,186 @@
+import time
+from collections import OrderedDict
+
+# estimated memory used by a cached record (ResourceRecord with __slots__,
+# its ints and rdata, domain names being interned and shared)
+RECORD_OVERHEAD = 120
+
+# estimated memory used by the rdata of a cached SOA record (two names, five ints)
+SOA_RDATA_SIZE = 200
+
+# longest time a negative response is cached, whatever its SOA says (RFC 2308)
+MAX_NEGATIVE_TTL = 3 * 3600
+
+
+def cache_ttl(dns_response):
+    """
+    Returns how long a response can be cached, None if it cannot be:
+    - Successful answers: their shortest TTL
+    - NXDOMAIN (RCODE 3) and NODATA (no error, no answer records): the SOA
+      minimum of the authority section, capped by the SOA's own TTL (RFC 2308)
+      and MAX_NEGATIVE_TTL
+    Other errors and negative responses without an SOA (e.g. referrals) are not cached.
+    """
+    rcode = dns_response.header.rcode
+    if rcode == 0 and dns_response.header.ancount > 0:
+        # answers of an unsupported type are not decoded, and not cached
+        if not dns_response.answers:
+            return None
+        ttl = min(record.ttl for record in dns_response.answers)
+    elif rcode in (0, 3):
+        soa = dns_response.start_of_authority()
+        if soa is None:
+            return None
+        ttl = min(soa.ttl, soa.rdata.minimum, MAX_NEGATIVE_TTL)
+        # a name not found through a CNAME expires with the CNAME too
+        for record in dns_response.answers:
+            ttl = min(ttl, record.ttl)
+    else:
+        return None
+    return ttl if ttl > 0 else None
+
+
+class DnsCache:
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        """
+        Initializes an in-memory response cache with:
+        - max_bytes: Estimated memory cap, least recently used entries are evicted above it
+        - entries: Maps (name, qtype, qclass) to (expiry, stored_at, size, dns_response),
+          ordered from least to most recently used
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(name, qtype, qclass):
+        # domain names are case insensitive and may be given fully qualified
+        return name.lower().rstrip("."), qtype, qclass
+
+    @staticmethod
+    def entry_size(dns_response):
+        """
+        Estimates the memory used by the records of a response
+        """
+        size = 0
+        for record in (
+            dns_response.answers + dns_response.authority + dns_response.additional
+        ):
+            if record.rtype == 0x0006:
+                size += RECORD_OVERHEAD + SOA_RDATA_SIZE
+            else:
+                size += RECORD_OVERHEAD + len(record.rdata)
+        return size
+
+    def lookup(self, name, qtype, qclass):
+        """
+        Returns the DnsResponse cached for the question and the number of
+        seconds since it was cached, or None on a miss
+        """
+        key = self.key(name, qtype, qclass)
+        entry = self.entries.get(key)
+        now = time.monotonic()
+
+        # miss if absent or expired (expired entries are dropped right away)
+        if entry is None or entry[0] <= now:
+            if entry is not None:
+                self.remove(key)
+            self.misses += 1
+            return None
+
+        # hit: mark as most recently used
+        self.entries.move_to_end(key)
+        self.hits += 1
+
+        _, stored_at, _, dns_response = entry
+        return dns_response, int(now - stored_at)
+
+    def lifetime_elapsed(self, name, qtype, qclass=0x0001):
+        """
+        Returns the fraction (0 to 1) of its TTL an entry has been cached for,
+        None if absent or expired. Not counted as a hit or a miss.
+        """
+        entry = self.entries.get(self.key(name, qtype, qclass))
+        now = time.monotonic()
+        if entry is None or entry[0] <= now:
+            return None
+        expiry, stored_at, _, _ = entry
+        return (now - stored_at) / (expiry - stored_at)
+
+    def get(self, name, qtype, qclass=0x0001):
+        """
+        Returns a copy of the cached DnsResponse for the question with every
+        record's TTL set to its remaining lifetime, or None on a miss.
+        """
+        hit = self.lookup(name, qtype, qclass)
+        if hit is None:
+            return None
+
+        # count down the TTL of each record from the time it was cached
+        dns_response, elapsed = hit
+        # own decoded sections, so the cached records keep their original TTLs
+        cached_response = dns_response.copy()
+        cached_response.answers = [
+            record.with_ttl(max(record.ttl - elapsed, 0))
+            for record in dns_response.answers
+        ]
+        cached_response.authority = [
+            record.with_ttl(max(record.ttl - elapsed, 0))
+            for record in dns_response.authority
+        ]
+        cached_response.additional = [
+            record.with_ttl(max(record.ttl - elapsed, 0))
+            for record in dns_response.additional
+        ]
+        return cached_response
+
+    def get_raw(self, name, qtype, qclass=0x0001):
+        """
+        Returns the cached response for the question in wire format, with
+        every record's TTL set to its remaining lifetime, or None on a miss.
+        """
+        hit = self.lookup(name, qtype, qclass)
+        if hit is None:
+            return None
+
+        dns_response, elapsed = hit
+        return dns_response.aged_raw_response(elapsed)
+
+    def put(self, name, qtype, qclass, dns_response):
+        """
+        Caches a successful response until its shortest answer TTL expires,
+        a negative one (NXDOMAIN or NODATA) for its SOA minimum TTL, see cache_ttl.
+        Responses with an error or a zero TTL are not cached.
+        """
+        ttl = cache_ttl(dns_response)
+        if ttl is None:
+            return
+
+        key = self.key(name, qtype, qclass)
+        if key in self.entries:
+            self.remove(key)
+
+        # entries larger than the whole cache are never stored
+        size = self.entry_size(dns_response)
+        if size > self.max_bytes:
+            return
+
+        now = time.monotonic()
+        self.entries[key] = (now + ttl, now, size, dns_response)
+        self.size += size
+
+        # evict least recently used entries until back under the memory cap
+        while self.size > self.max_bytes:
+            _, (_, _, evicted_size, _) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def remove(self, key):
+        _, _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,275 @@
+import hashlib
+import mmap
+import os
+import struct
+import time
+import zlib
+import DnsCache as cache
+import DnsResponse as response
+
+try:
+    import fcntl
+except ImportError:  # no advisory file locks (e.g. Windows), rely on the checksums
+    fcntl = None
+
+# file header: magic, version, slot size, number of slots
+FILE_MAGIC = b"DNSC"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct(">4sHII")
+FILE_HEADER_SIZE = 64
+
+# slot header: key hash (0 = empty), absolute expiry, time stored,
+# key length, wire-format response length, crc32 of key + response
+SLOT_HEADER = struct.Struct(">QddHHI")
+SLOT_SIZE = 1024
+SLOT_CAPACITY = SLOT_SIZE - SLOT_HEADER.size
+
+# number of consecutive slots probed for a key (linear probing)
+MAX_PROBES = 8
+
+
+class PersistentDnsCache:
+    def __init__(self, path, num_slots=4096):
+        """
+        Opens (creating it if needed) a response cache file shared across processes:
+        - path: Path of the cache file
+        - num_slots: Number of fixed-size slots of the hash table, for a new file
+
+        The file is a memory-mapped open-addressing hash table, each slot holds
+        one wire-format response with the absolute time at which it expires.
+        Readers hold a shared lock and writers an exclusive lock on the file.
+        Raises a ValueError if the file exists but is not a cache file.
+        """
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.map = None
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+        try:
+            self.num_slots = self.initialize(num_slots)
+        except ValueError:
+            os.close(self.fd)
+            raise
+
+        self.map = mmap.mmap(self.fd, FILE_HEADER_SIZE + self.num_slots * SLOT_SIZE)
+
+    def initialize(self, num_slots):
+        """
+        Initializes the file once, under the exclusive lock, unless it is
+        already a cache file. Returns its number of slots.
+        """
+        self.lock(exclusive=True)
+        try:
+            existing_slots = self.read_file_header()
+            if existing_slots is not None:
+                return existing_slots
+
+            # the magic first, so a file left half-initialized is still
+            # recognized as a cache file
+            os.pwrite(
+                self.fd,
+                FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, SLOT_SIZE, num_slots),
+                0,
+            )
+            os.ftruncate(self.fd, FILE_HEADER_SIZE + num_slots * SLOT_SIZE)
+            return num_slots
+        finally:
+            self.unlock()
+
+    def read_file_header(self):
+        """
+        Returns the number of slots of an existing cache file, None if the
+        file is empty or a cache file to initialize again (of another version,
+        or half-initialized). Raises a ValueError for any other file, which
+        is left untouched.
+        """
+        if os.fstat(self.fd).st_size == 0:
+            return None
+        header = os.pread(self.fd, FILE_HEADER.size, 0)
+        if len(header) < FILE_HEADER.size or header[:4] != FILE_MAGIC:
+            raise ValueError(f"{self.path} is not a DNS cache file")
+
+        magic, version, slot_size, num_slots = FILE_HEADER.unpack(header)
+        if (version, slot_size) != (FILE_VERSION, SLOT_SIZE):
+            return None
+        if os.fstat(self.fd).st_size < FILE_HEADER_SIZE + num_slots * SLOT_SIZE:
+            return None
+        return num_slots
+
+    def lock(self, exclusive=False):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    def unlock(self):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            os.close(self.fd)
+            self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def key(name, qtype, qclass):
+        """
+        Returns the encoded key of a question and its 64-bit hash,
+        stable across processes (unlike hash())
+        """
+        key = name.lower().rstrip(".").encode("utf-8") + struct.pack(
+            ">HH", qtype, qclass
+        )
+        key_hash = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
+        return key, key_hash or 1  # 0 marks an empty slot
+
+    def slot_offsets(self, key_hash):
+        # offsets of the slots probed for a key
+        first = key_hash % self.num_slots
+        for i in range(min(MAX_PROBES, self.num_slots)):
+            yield FILE_HEADER_SIZE + ((first + i) % self.num_slots) * SLOT_SIZE
+
+    def read_slot(self, offset):
+        """
+        Returns (key_hash, expiry, stored_at, key, raw_response) of a slot,
+        None for an empty or corrupted slot
+        """
+        key_hash, expiry, stored_at, key_length, data_length, checksum = (
+            SLOT_HEADER.unpack_from(self.map, offset)
+        )
+        if key_hash == 0 or key_length + data_length > SLOT_CAPACITY:
+            return None
+
+        start = offset + SLOT_HEADER.size
+        payload = self.map[start : start + key_length + data_length]
+        if zlib.crc32(payload) != checksum:
+            return None
+
+        return key_hash, expiry, stored_at, payload[:key_length], payload[key_length:]
+
+    def find_slot(self, name, qtype, qclass):
+        """
+        Returns the slot (as read by read_slot) of the question, None if absent
+        """
+        key, key_hash = self.key(name, qtype, qclass)
+
+        self.lock()
+        try:
+            for offset in self.slot_offsets(key_hash):
+                slot = self.read_slot(offset)
+                if slot is not None and slot[0] == key_hash and slot[3] == key:
+                    return slot
+            return None
+        finally:
+            self.unlock()
+
+    def lifetime_elapsed(self, name, qtype, qclass=0x0001):
+        """
+        Returns the fraction (0 to 1) of its TTL an entry has been cached for,
+        None if absent or expired. Not counted as a hit or a miss.
+        """
+        slot = self.find_slot(name, qtype, qclass)
+        now = time.time()
+        if slot is None or slot[1] <= now:
+            return None
+        _, expiry, stored_at, _, _ = slot
+        return (now - stored_at) / (expiry - stored_at)
+
+    def lookup(self, name, qtype, qclass):
+        """
+        Returns the DnsResponse cached for the question and the number of
+        seconds since it was cached, or None on a miss
+        """
+        slot = self.find_slot(name, qtype, qclass)
+        now = time.time()
+
+        if slot is None or slot[1] <= now:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        _, _, stored_at, _, raw_response = slot
+        return response.DnsResponse(raw_response), int(now - stored_at)
+
+    def get(self, name, qtype, qclass=0x0001):
+        """
+        Returns the cached DnsResponse for the question with every record's TTL
+        set to its remaining lifetime, or None on a miss.
+        """
+        hit = self.lookup(name, qtype, qclass)
+        if hit is None:
+            return None
+
+        # count down the TTL of each record from the time it was cached
+        dns_response, elapsed = hit
+        for record in (
+            dns_response.answers + dns_response.authority + dns_response.additional
+        ):
+            record.ttl = max(record.ttl - elapsed, 0)
+        return dns_response
+
+    def get_raw(self, name, qtype, qclass=0x0001):
+        """
+        Returns the cached response for the question in wire format, with
+        every record's TTL set to its remaining lifetime, or None on a miss.
+        """
+        hit = self.lookup(name, qtype, qclass)
+        if hit is None:
+            return None
+
+        dns_response, elapsed = hit
+        return dns_response.aged_raw_response(elapsed)
+
+    def put(self, name, qtype, qclass, dns_response):
+        """
+        Caches a successful response until its shortest answer TTL expires,
+        a negative one (NXDOMAIN or NODATA) for its SOA minimum TTL, see
+        DnsCache.cache_ttl. Responses with an error, a zero TTL or too large
+        for a slot are not cached.
+        """
+        ttl = cache.cache_ttl(dns_response)
+        key, key_hash = self.key(name, qtype, qclass)
+        raw_response = bytes(dns_response.raw_response)
+        payload = key + raw_response
+        if ttl is None or len(payload) > SLOT_CAPACITY:
+            return
+
+        now = time.time()
+        slot_header = SLOT_HEADER.pack(
+            key_hash,
+            now + ttl,
+            now,
+            len(key),
+            len(raw_response),
+            zlib.crc32(payload),
+        )
+
+        self.lock(exclusive=True)
+        try:
+            # reuse the slot of the same key, else an empty or expired slot,
+            # else evict the probed slot closest to expiring
+            target = None
+            target_expiry = None
+            for offset in self.slot_offsets(key_hash):
+                slot = self.read_slot(offset)
+                if slot is None or (slot[0] == key_hash and slot[3] == key):
+                    target = offset
+                    break
+                if target is None or slot[1] < target_expiry:
+                    target, target_expiry = offset, slot[1]
+
+            # write the payload before the header so a crash mid-write
+            # leaves a slot whose checksum does not match
+            start = target + SLOT_HEADER.size
+            self.map[start : start + len(payload)] = payload
+            self.map[target : target + SLOT_HEADER.size] = slot_header
+        finally:
+            self.unlock()
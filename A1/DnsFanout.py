@@ -0,0 +1,178 @@
+import asyncio
+import DnsResponse as response
+
+# record types whose rdata is a host name whose addresses are looked up
+TARGET_RTYPES = (0x0002, 0x000F)  # NS, MX
+
+
+def record_key(record):
+    # records are the same if they only differ by TTL or letter case of the name
+    return (
+        record.domain_name.lower(),
+        record.rtype,
+        record.rdata_text(),
+        record.preference,
+    )
+
+
+class FanoutResult:
+    def __init__(self, domain, qtypes):
+        """
+        Initializes the merged result of a lookup of several types for a name with:
+        - responses: DnsResponse of each query type answered
+        - errors: Exception raised for each query type not answered
+        - invalid: Query types whose response failed the validity check,
+          their records being neither merged nor used as glue
+        - answers: Answer records of every response, without duplicates
+        - additional: A records of the NS and MX targets, taken from the glue
+          of the additional sections or looked up when there was none
+        - target_errors: Exception raised looking up a target without glue
+        - retries: Retries of the query of each type
+        - target_retries: Retries of the lookups of the targets
+        - extra_lookups: Number of A queries sent for targets without glue
+        """
+        self.domain = domain
+        self.qtypes = list(qtypes)
+        self.responses = {}
+        self.errors = {}
+        self.invalid = set()
+        self.answers = []
+        self.additional = []
+        self.target_errors = {}
+        self.retries = {}
+        self.target_retries = 0
+        self.extra_lookups = 0
+        self.seen = set()  # keys of the records merged so far
+
+    @property
+    def authoritative(self):
+        # whether every response came from an authoritative server
+        return bool(self.responses) and all(
+            dns_response.header.aa for dns_response in self.responses.values()
+        )
+
+    @property
+    def not_found(self):
+        # whether every response said the name does not exist (NXDOMAIN)
+        return bool(self.responses) and all(
+            dns_response.header.rcode == 3 for dns_response in self.responses.values()
+        )
+
+    def merge(self, records, section):
+        for record in records:
+            key = record_key(record)
+            if key not in self.seen:
+                self.seen.add(key)
+                section.append(record)
+
+    def targets(self):
+        """
+        Returns the host names of the NS and MX answers, in order, without duplicates
+        """
+        targets = []
+        for record in self.answers:
+            if record.rtype in TARGET_RTYPES and record.rdata.lower() not in targets:
+                targets.append(record.rdata.lower())
+        return targets
+
+    def glue(self):
+        """
+        Returns the A records of every valid response (answers and additional
+        sections) by lowercase owner name
+        """
+        addresses = {}
+        for qtype, dns_response in self.responses.items():
+            if qtype in self.invalid:
+                continue
+            for record in dns_response.answers + dns_response.additional:
+                if record.rtype == 0x0001:
+                    addresses.setdefault(record.domain_name.lower(), []).append(record)
+        return addresses
+
+
+def outcome_error(outcome):
+    # exception gathered for a query, re-raised if it is not an error (cancellation)
+    if isinstance(outcome, BaseException):
+        if not isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return None
+
+
+async def resolve_types(
+    resolver, domain, qtypes, qclass=0x0001, resolve_targets=True, check=None
+):
+    """
+    Queries several types for a name at once, over the shared socket of an
+    asyncio resolver (AsyncDnsResolver, RacingResolver or IterativeResolver),
+    and merges the records of the responses into a FanoutResult.
+    With resolve_targets, the addresses of the NS and MX targets are taken
+    from the glue of the responses, and only the targets without glue are
+    looked up (concurrently). Errors are collected per type rather than raised.
+    check is an optional function returning the error message of an invalid
+    response (unexpected flags or an error RCODE), None for a valid one: the
+    records of invalid responses are not merged.
+    """
+    result = FanoutResult(domain, qtypes)
+    outcomes = await asyncio.gather(
+        *(resolver.query(domain, qtype, qclass) for qtype in result.qtypes),
+        return_exceptions=True,
+    )
+    for qtype, outcome in zip(result.qtypes, outcomes):
+        error = outcome_error(outcome)
+        if error is not None:
+            result.errors[qtype] = error
+            continue
+        dns_response, retries = outcome
+        try:
+            # decode the records right away, so a malformed response is an error
+            # of its query type rather than of the whole lookup
+            dns_response.answers
+            dns_response.additional
+        except response.MalformedResponseError as error:
+            result.errors[qtype] = error
+            continue
+        result.responses[qtype] = dns_response
+        result.retries[qtype] = retries
+        if check is not None and check(dns_response) is not None:
+            result.invalid.add(qtype)
+            continue
+        result.merge(dns_response.answers, result.answers)
+
+    if not resolve_targets:
+        return result
+
+    glue = result.glue()
+    missing = []
+    for target in result.targets():
+        if target in glue:
+            result.merge(glue[target], result.additional)
+        else:
+            missing.append(target)
+
+    # one round trip for all the targets without glue
+    result.extra_lookups = len(missing)
+    outcomes = await asyncio.gather(
+        *(resolver.query(target, 0x0001, qclass) for target in missing),
+        return_exceptions=True,
+    )
+    for target, outcome in zip(missing, outcomes):
+        error = outcome_error(outcome)
+        if error is not None:
+            result.target_errors[target] = error
+            continue
+        dns_response, retries = outcome
+        result.target_retries += retries
+        error_message = None if check is None else check(dns_response)
+        if error_message is not None:
+            result.target_errors[target] = ValueError(error_message)
+            continue
+        try:
+            addresses = [
+                record for record in dns_response.answers if record.rtype == 0x0001
+            ]
+        except response.MalformedResponseError as error:
+            result.target_errors[target] = error
+            continue
+        result.merge(addresses, result.additional)
+    return result
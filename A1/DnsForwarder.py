@@ -0,0 +1,218 @@
+import asyncio
+import struct
+import time
+import DnsResponse as response
+
+# response codes sent back to clients
+RCODE_FORMAT_ERROR = 1
+RCODE_SERVER_FAILURE = 2
+RCODE_NOT_IMPLEMENTED = 4
+
+# largest UDP response to a client that did not advertise a payload size (EDNS0)
+DEFAULT_UDP_PAYLOAD_SIZE = 512
+
+
+def client_payload_size(request):
+    """
+    Returns the largest UDP response the client can receive, as advertised
+    by the EDNS0 OPT record of its query (512 bytes without one)
+    """
+    offset = request.section_offset("additional")
+    for i in range(request.header.arcount):
+        offset = request.skip_domain_name(request.view, offset)
+        response.check_bounds(request.view, offset + 10, "record")
+        rtype, rclass, _, rdlength = struct.unpack_from(">HHIH", request.view, offset)
+        if rtype == 41:
+            return max(rclass, DEFAULT_UDP_PAYLOAD_SIZE)
+        offset += 10 + rdlength
+    return DEFAULT_UDP_PAYLOAD_SIZE
+
+
+def error_response(request, rcode, truncated=False):
+    """
+    Builds a response with no records to a query: its header (with the given
+    RCODE, or the TC flag set) followed by its question
+    """
+    header = request.header
+    flags = (
+        (1 << 15)  # QR: response
+        | (header.opcode << 11)
+        | (truncated << 9)  # TC
+        | (header.rd << 8)  # RD copied from the query
+        | (1 << 7)  # RA: recursion available
+        | rcode
+    )
+    question_end = request.section_offset("answers")
+    return struct.pack(">HHHHHH", header.id, flags, header.qdcount, 0, 0, 0) + bytes(
+        request.view[12:question_end]
+    )
+
+
+class DnsForwarder:
+    def __init__(self, resolver, cache, prefetcher=None):
+        """
+        Initializes a caching DNS forwarder with:
+        - resolver: Asyncio resolver (e.g. RacingResolver) querying the upstream
+          servers on cache misses, without a cache of its own
+        - cache: DnsCache or PersistentDnsCache the answers are served from,
+          in wire format with their TTLs lowered to their remaining lifetime
+        - prefetcher: Optional Prefetcher of the cache, refreshing the hot
+          answers in the background before they expire
+        - tasks: Queries being answered, referenced until they complete
+        """
+        self.resolver = resolver
+        self.cache = cache
+        self.prefetcher = prefetcher
+        self.tasks = set()
+
+        # statistics
+        self.started_at = time.monotonic()
+        self.queries = 0
+        self.hits = 0
+        self.failures = 0
+
+    async def answer(self, data, over_udp=True):
+        """
+        Returns the wire-format response to a query, None for packets too
+        malformed to be answered. Over UDP, a response larger than the client
+        can receive is replaced by an empty truncated one.
+        """
+        self.queries += 1
+        try:
+            request = response.DnsResponse(data)
+            question = request.question
+            max_size = client_payload_size(request) if over_udp else 65535
+        except response.MalformedResponseError:
+            return None
+
+        if request.header.qr != 0:
+            return None  # a response, not a query
+        if request.header.opcode != 0:
+            return error_response(request, RCODE_NOT_IMPLEMENTED)
+        if request.header.qdcount != 1:
+            return error_response(request, RCODE_FORMAT_ERROR)
+
+        raw_response = self.cache.get_raw(
+            question.domain, question.rtype, question.rclass
+        )
+        if raw_response is not None:
+            self.hits += 1
+            if self.prefetcher is not None:
+                self.prefetcher.hit(
+                    question.domain, question.rtype, question.rclass, self.refresh
+                )
+        else:
+            try:
+                dns_response, _ = await self.resolver.query(
+                    question.domain, question.rtype, question.rclass
+                )
+            except (OSError, ValueError):
+                self.failures += 1
+                return error_response(request, RCODE_SERVER_FAILURE)
+            self.cache.put(
+                question.domain, question.rtype, question.rclass, dns_response
+            )
+            raw_response = bytearray(dns_response.raw_response)
+
+        if len(raw_response) > max_size:
+            return error_response(request, 0, truncated=True)
+
+        # answer with the ID and question (with its letter case) of the query
+        question_end = request.section_offset("answers")
+        raw_response[:question_end] = (
+            data[:2] + raw_response[2:12] + data[12:question_end]
+        )
+        return raw_response
+
+    async def refresh(self, domain, qtype, qclass):
+        # query the upstream servers again, bypassing the cache
+        dns_response, _ = await self.resolver.query(domain, qtype, qclass)
+        self.cache.put(domain, qtype, qclass, dns_response)
+
+    def answer_later(self, data, send):
+        """
+        Answers a UDP query concurrently with the others, sending the response
+        with send once it is ready
+        """
+
+        async def answer_and_send():
+            raw_response = await self.answer(data)
+            if raw_response is not None:
+                send(raw_response)
+
+        task = asyncio.ensure_future(answer_and_send())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def statistics(self):
+        """
+        Returns the number of queries, the queries per second since the
+        forwarder started and the cache hit rate
+        """
+        elapsed = time.monotonic() - self.started_at
+        qps = self.queries / elapsed if elapsed > 0 else 0.0
+        hit_rate = self.hits / self.queries if self.queries else 0.0
+        return self.queries, qps, hit_rate
+
+
+class UdpListener(asyncio.DatagramProtocol):
+    def __init__(self, forwarder):
+        """
+        Initializes the UDP listener of a forwarder, answering every client
+        from the same socket
+        """
+        self.forwarder = forwarder
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12:
+            return
+        self.forwarder.answer_later(
+            data, lambda raw_response: self.transport.sendto(raw_response, addr)
+        )
+
+    def error_received(self, error):
+        # ICMP errors from clients that went away
+        pass
+
+
+async def serve_tcp_client(forwarder, reader, writer):
+    """
+    Answers the queries of a TCP client (after a truncated UDP response),
+    each message being prefixed by its 2-byte length
+    """
+    try:
+        while True:
+            length = struct.unpack(">H", await reader.readexactly(2))[0]
+            data = await reader.readexactly(length)
+            if length < 12:
+                break
+            raw_response = await forwarder.answer(data, over_udp=False)
+            if raw_response is None:
+                break
+            writer.write(struct.pack(">H", len(raw_response)) + raw_response)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass  # client closed the connection
+    finally:
+        writer.close()
+
+
+async def start(forwarder, address, port):
+    """
+    Starts listening for queries over UDP and TCP on the address and port.
+    Returns the UDP transport and the TCP server, to be closed to stop.
+    """
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: UdpListener(forwarder), local_addr=(address, port)
+    )
+    tcp_server = await asyncio.start_server(
+        lambda reader, writer: serve_tcp_client(forwarder, reader, writer),
+        address,
+        port,
+    )
+    return transport, tcp_server
@@ -0,0 +1,339 @@
+import asyncio
+import struct
+import time
+import DnsAsyncResolver as async_resolver
+import DnsQuery as query
+import DnsResponse as response
+import DnsRtt as rtt_estimation
+
+# IPv4 addresses of the root nameservers (a.root-servers.net to m.root-servers.net)
+ROOT_HINTS = [
+    "198.41.0.4",
+    "170.247.170.2",
+    "192.33.4.12",
+    "199.7.91.13",
+    "192.203.230.10",
+    "192.5.5.241",
+    "192.112.36.4",
+    "198.97.190.53",
+    "192.36.148.17",
+    "192.58.128.30",
+    "193.0.14.129",
+    "199.7.83.42",
+    "202.12.27.33",
+]
+
+# limits on a single resolution, so misconfigured zones cannot make it loop
+MAX_REFERRALS = 16
+MAX_CNAME_HOPS = 8
+MAX_NAMESERVER_DEPTH = 4
+
+
+def normalize(name):
+    # domain names are case insensitive and may be given fully qualified
+    return name.lower().rstrip(".")
+
+
+def in_zone(name, zone):
+    # whether name is the zone itself or a name below it ("" is the root zone)
+    return zone == "" or name == zone or name.endswith("." + zone)
+
+
+class DelegationCache:
+    def __init__(self, root_hints=ROOT_HINTS):
+        """
+        Initializes a cache of zone cuts with:
+        - root_hints: Addresses of the root nameservers, used for names under
+          no cached zone
+        - zones: Maps each zone to (expiry, addresses of its nameservers)
+        """
+        self.root_hints = list(root_hints)
+        self.zones = {}
+
+    def put(self, zone, addresses, ttl):
+        """
+        Caches the nameserver addresses of a zone for ttl seconds
+        """
+        if ttl > 0:
+            self.zones[zone] = (time.monotonic() + ttl, list(addresses))
+
+    def closest(self, name):
+        """
+        Returns the deepest cached zone enclosing name and the addresses
+        of its nameservers, the root zone ("") and root hints if none is cached
+        """
+        now = time.monotonic()
+        labels = name.split(".") if name else []
+        for i in range(len(labels)):
+            zone = ".".join(labels[i:])
+            entry = self.zones.get(zone)
+            if entry is not None:
+                if entry[0] > now:
+                    return zone, entry[1]
+                del self.zones[zone]  # expired delegation
+        return "", self.root_hints
+
+    def __len__(self):
+        return len(self.zones)
+
+
+def chained_response(domain, qtype, qclass, chain, dns_response):
+    """
+    Returns a new DnsResponse to the question for domain, encoded from the
+    records of the final response with the CNAME chain followed prepended to
+    its answers, so its wire format (cached, served and measured) holds the
+    chain too. The final response, possibly shared, is left unchanged.
+    Records that are not decoded (e.g. the EDNS0 OPT record) are left out.
+    """
+    flags = struct.unpack_from(">H", dns_response.raw_response, 2)[0]
+    answers = chain + dns_response.answers
+    sections = (answers, dns_response.authority, dns_response.additional)
+    raw_response = struct.pack(
+        ">HHHHHH", dns_response.header.id, flags, 1, *map(len, sections)
+    )
+    raw_response += query.encode_question(domain, qtype, qclass)
+    raw_response += b"".join(
+        record.encode() for section in sections for record in section
+    )
+    return response.DnsResponse(raw_response)
+
+
+class IterativeResolver:
+    def __init__(
+        self,
+        root_hints=ROOT_HINTS,
+        port=53,
+        timeout=5,
+        max_retries=3,
+        max_in_flight=1000,
+        cache=None,
+        rtt=None,
+        edns_payload_size=None,
+    ):
+        """
+        Initializes a resolver following referrals from the root nameservers
+        down to the authoritative nameservers of each name, with:
+        - delegations: DelegationCache of the zone cuts learned from referrals
+        - resolvers: Maps each nameserver address to the task opening its
+          AsyncDnsResolver (queries are sent with RD=0)
+        - rtt: RttTable ranking the nameservers of a zone by health
+        The other arguments are those of AsyncDnsResolver, the cache only
+        holding the final responses.
+        """
+        self.port = port
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_in_flight = max_in_flight
+        self.cache = cache
+        self.rtt = rtt if rtt is not None else rtt_estimation.RttTable()
+        self.edns_payload_size = edns_payload_size
+        self.delegations = DelegationCache(root_hints)
+        self.resolvers = {}
+
+    async def open(self):
+        # resolvers are opened on first use of each nameserver
+        return self
+
+    def close(self):
+        for task in self.resolvers.values():
+            if task.done() and not task.cancelled() and task.exception() is None:
+                task.result().close()
+            else:
+                task.cancel()
+        self.resolvers.clear()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    async def resolver(self, address):
+        """
+        Returns the AsyncDnsResolver of a nameserver, opened once even if
+        several queries need it at the same time
+        """
+        if address not in self.resolvers:
+            resolver = async_resolver.AsyncDnsResolver(
+                address,
+                self.port,
+                self.timeout,
+                self.max_retries,
+                self.max_in_flight,
+                None,
+                self.rtt,
+                self.edns_payload_size,
+                recursion_desired=False,
+            )
+            self.resolvers[address] = asyncio.ensure_future(resolver.open())
+        return await self.resolvers[address]
+
+    async def query_zone(self, zone, addresses, name, qtype, qclass):
+        """
+        Queries the nameservers of a zone, healthiest first, until one answers.
+        Returns its DnsResponse and the number of retries it took.
+        """
+        ranked = sorted(addresses, key=lambda a: self.rtt.get(a, self.port).score())
+        last_error = TimeoutError(f"No nameserver of zone {zone or '.'} answered")
+        server_error = None
+
+        for address in ranked:
+            estimator = self.rtt.get(address, self.port)
+            try:
+                resolver = await self.resolver(address)
+                dns_response, retries = await resolver.query(name, qtype, qclass)
+            # timed out, refused or unreachable nameserver
+            except OSError as error:
+                estimator.failed()
+                last_error = error
+                continue
+
+            # the other nameservers of the zone may well answer
+            if dns_response.header.rcode in async_resolver.RETRY_RCODES:
+                estimator.failed()
+                server_error = (dns_response, retries)
+                continue
+
+            return dns_response, retries
+
+        if server_error is not None:
+            return server_error
+        raise last_error
+
+    def referral(self, zone, name, dns_response):
+        """
+        Returns the delegation of a referral response to a zone below the
+        queried one: the child zone, the names of its nameservers, their glue
+        addresses and the TTL of the delegation. None if it is not a referral.
+        """
+        ns_records = [
+            record
+            for record in dns_response.authority
+            if record.rtype == 0x0002
+            and in_zone(name, normalize(record.domain_name))
+            and normalize(record.domain_name) != zone
+            and in_zone(normalize(record.domain_name), zone)
+        ]
+        if not ns_records:
+            return None
+
+        # every NS record of a referral delegates the same child zone
+        child_zone = normalize(ns_records[0].domain_name)
+        ns_records = [r for r in ns_records if normalize(r.domain_name) == child_zone]
+        ns_names = [normalize(record.rdata) for record in ns_records]
+
+        # glue: the addresses of the nameservers, in the additional section
+        glue_records = [
+            record
+            for record in dns_response.additional
+            if record.rtype == 0x0001 and normalize(record.domain_name) in ns_names
+        ]
+        addresses = [record.rdata_text() for record in glue_records]
+        ttl = min(record.ttl for record in ns_records + glue_records)
+        return child_zone, ns_names, addresses, ttl
+
+    async def nameserver_addresses(self, ns_names, depth):
+        """
+        Resolves the addresses of nameservers given without glue, trying each
+        name in turn until one resolves
+        """
+        if depth >= MAX_NAMESERVER_DEPTH:
+            return []
+
+        for ns_name in ns_names:
+            try:
+                dns_response, _ = await self.resolve(ns_name, 0x0001, depth=depth + 1)
+            except (OSError, ValueError):
+                continue
+            addresses = [r.rdata_text() for r in dns_response.answers if r.rtype == 1]
+            if addresses:
+                return addresses
+        return []
+
+    async def resolve_name(self, name, qtype, qclass, depth):
+        """
+        Follows referrals for a name from the closest cached zone, caching each
+        delegation. Returns the final DnsResponse (an answer, an error or an
+        authoritative empty response) and the number of retries it took.
+        """
+        zone, addresses = self.delegations.closest(name)
+        retries = 0
+
+        for _ in range(MAX_REFERRALS):
+            dns_response, used = await self.query_zone(
+                zone, addresses, name, qtype, qclass
+            )
+            retries += used
+
+            header = dns_response.header
+            if header.rcode != 0 or header.aa or dns_response.answers:
+                return dns_response, retries
+
+            referral = self.referral(zone, name, dns_response)
+            if referral is None:
+                raise ValueError(
+                    f"Lame delegation: zone {zone or '.'} gave no answer or referral for {name}"
+                )
+
+            zone, ns_names, addresses, ttl = referral
+            if not addresses:
+                addresses = await self.nameserver_addresses(ns_names, depth)
+                if not addresses:
+                    raise ValueError(f"No address found for the nameservers of {zone}")
+            self.delegations.put(zone, addresses, ttl)
+
+        raise ValueError(f"Too many referrals resolving {name}")
+
+    async def resolve(self, domain, qtype, qclass=0x0001, depth=0):
+        """
+        Resolves a name iteratively, following CNAME records to their target.
+        Returns the final DnsResponse, its answers preceded by the CNAME records
+        followed (see chained_response), and the number of retries it took.
+        """
+        name = normalize(domain)
+        chain = []  # answers of the responses whose CNAME was followed
+        retries = 0
+
+        for _ in range(MAX_CNAME_HOPS):
+            dns_response, used = await self.resolve_name(name, qtype, qclass, depth)
+            retries += used
+            answers = dns_response.answers
+            if (
+                dns_response.header.rcode != 0
+                or qtype == 0x0005
+                or any(record.rtype == qtype for record in answers)
+            ):
+                break
+
+            # follow the CNAME chain of the response to its last target
+            aliases = {
+                normalize(r.domain_name): normalize(r.rdata)
+                for r in answers
+                if r.rtype == 0x0005
+            }
+            if name not in aliases:
+                break
+            while name in aliases:
+                name = aliases.pop(name)
+            chain += answers
+        else:
+            raise ValueError(f"Too many CNAME records resolving {domain}")
+
+        if chain:
+            dns_response = chained_response(domain, qtype, qclass, chain, dns_response)
+        return dns_response, retries
+
+    async def query(self, domain, qtype, qclass=0x0001):
+        """
+        Resolves a name iteratively, serving repeated questions from the cache.
+        Returns the DnsResponse and the number of retries it took.
+        """
+        if self.cache is not None:
+            cached_response = self.cache.get(domain, qtype, qclass)
+            if cached_response is not None:
+                return cached_response, 0
+
+        dns_response, retries = await self.resolve(domain, qtype, qclass)
+        if self.cache is not None:
+            self.cache.put(domain, qtype, qclass, dns_response)
+        return dns_response, retries
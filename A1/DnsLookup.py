@@ -0,0 +1,365 @@
+import threading
+import time
+import DnsAsyncResolver as async_resolver
+import DnsQuery as query
+import DnsResponse as response
+import DnsRtt as rtt_estimation
+import DnsTransport as transport
+
+# query types that can be looked up, by name
+QTYPES = {"A": 0x0001, "NS": 0x0002, "CNAME": 0x0005, "SOA": 0x0006, "MX": 0x000F}
+
+# error message of each response RCODE flag (NXDOMAIN is NameNotFoundError)
+RCODE_ERRORS = {
+    1: "Format error: The name server was unable to interpret the query",
+    2: "Server failure: The name server was unable to process this query due to a problem with the name server",
+    4: "Not implemented: The name server does not support the requested kind of query",
+    5: "Refused: The name server refuses to perform the requested operation for policy reasons",
+}
+
+# server errors after which the next server is tried
+FAILOVER_RCODES = (2, 5)
+
+
+class DnsError(Exception):
+    """
+    Base class of the errors raised by a lookup
+    """
+
+
+class DnsTimeoutError(DnsError, TimeoutError):
+    """
+    No response after every retry to every server
+    """
+
+
+class DnsConnectionError(DnsError, ConnectionError):
+    """
+    A server could not be reached (e.g. its TCP connection was refused)
+    """
+
+
+class MalformedResponseError(DnsError, response.MalformedResponseError):
+    """
+    The response could not be decoded
+    """
+
+
+class UnexpectedResponseError(DnsError):
+    """
+    The response is not a valid answer to the query (QR or RA flag not set)
+    """
+
+
+class DnsResponseError(DnsError):
+    """
+    The server answered with an error RCODE, in rcode
+    """
+
+    def __init__(self, message, rcode):
+        super().__init__(message)
+        self.rcode = rcode
+
+
+class NameNotFoundError(DnsResponseError):
+    """
+    The name does not exist (NXDOMAIN, RCODE 3)
+    """
+
+    def __init__(self, name):
+        super().__init__(f"Name not found: {name}", 3)
+        self.name = name
+
+
+class LookupResult:
+    """
+    Answer to a lookup, its records being DnsResponse.ResourceRecord objects
+    """
+
+    __slots__ = (
+        "name",
+        "qtype",
+        "server",
+        "rcode",
+        "authoritative",
+        "answers",
+        "authority",
+        "additional",
+        "latency",
+        "retries",
+    )
+
+    def __init__(self, name, qtype, server, dns_response, latency, retries):
+        """
+        Initializes the result of a lookup with:
+        - server: Address of the server that answered, "cache" for a cache hit
+        - answers, authority, additional: The records of each section
+          (no answers for a name without records of the type)
+        - latency: Seconds the lookup took
+        - retries: Number of retransmissions
+        """
+        self.name = name
+        self.qtype = qtype
+        self.server = server
+        self.rcode = dns_response.header.rcode
+        self.authoritative = bool(dns_response.header.aa)
+        self.answers = dns_response.answers
+        self.authority = dns_response.authority
+        self.additional = dns_response.additional
+        self.latency = latency
+        self.retries = retries
+
+    @property
+    def addresses(self):
+        # IPv4 addresses of the A answers, in dotted-decimal
+        return [r.rdata_text() for r in self.answers if r.rtype == 0x0001]
+
+    @property
+    def ttl(self):
+        # shortest TTL of the answers, None without answers
+        return min((record.ttl for record in self.answers), default=None)
+
+    def __repr__(self):
+        return (
+            f"LookupResult({self.name!r}, {self.qtype}, server={self.server!r}, "
+            f"answers={self.answers!r})"
+        )
+
+
+def malformed(error):
+    # MalformedResponseError of a decode error, the parser's own errors
+    # already saying the response is malformed
+    message = str(error)
+    if not message.startswith("Malformed response"):
+        message = f"Malformed response: {message}"
+    return MalformedResponseError(message)
+
+
+def check_limits(timeout, retries):
+    # a lookup needs at least one attempt and a positive wait for its response
+    if retries < 1:
+        raise ValueError(f"retries must be at least 1, not {retries}")
+    if timeout <= 0:
+        raise ValueError(f"timeout must be positive, not {timeout}")
+
+
+def qtype_code(qtype):
+    """
+    Returns the code of a query type given by code or by name (e.g. "MX")
+    """
+    if isinstance(qtype, str):
+        if qtype.upper() not in QTYPES:
+            raise ValueError(f"Unsupported query type {qtype}")
+        return QTYPES[qtype.upper()]
+    return qtype
+
+
+def response_error(name, dns_response, recursive=True):
+    """
+    Returns the DnsError of a response's flags or RCODE, None for a valid
+    response (NameNotFoundError for NXDOMAIN). Responses of authoritative
+    servers queried iteratively (recursive=False) need not set the RA flag.
+    """
+    if dns_response.header.qr != 1:
+        return UnexpectedResponseError("Response QR flag is not set to 1")
+    if recursive and dns_response.header.ra != 1:
+        return UnexpectedResponseError("Server does not support recursive queries")
+
+    rcode = dns_response.header.rcode
+    if rcode == 3:
+        return NameNotFoundError(name)
+    if rcode != 0:
+        message = RCODE_ERRORS.get(rcode, f"Response code {rcode}")
+        return DnsResponseError(message, rcode)
+    return None
+
+
+def check_response(name, dns_response, recursive=True):
+    """
+    Raises the error of a response: unexpected flags, an error RCODE or
+    malformed records (every section is decoded), see response_error.
+    """
+    error = response_error(name, dns_response, recursive)
+    if error is not None:
+        raise error
+
+    try:
+        dns_response.answers
+        dns_response.authority
+        dns_response.additional
+    except response.MalformedResponseError as error:
+        raise malformed(error) from error
+
+
+class Resolver:
+    def __init__(
+        self,
+        servers,
+        port=53,
+        timeout=5,
+        retries=3,
+        edns_payload_size=None,
+        cache=None,
+    ):
+        """
+        Initializes a blocking resolver, safe to share between threads, with:
+        - servers: IPv4 address of a DNS server, or a list of them tried from
+          the healthiest to the least healthy until one answers
+        - timeout: Longest wait, in seconds, before retransmitting a query
+        - retries: Maximum number of times a query is sent to each server
+        - edns_payload_size: Optional UDP payload size advertised with EDNS0
+        - cache: Optional DnsCache or PersistentDnsCache answering repeated lookups,
+          accessed under the lock of the resolver (neither cache is thread-safe
+          by itself), so it must not be shared with other resolvers or threads
+        Sockets and TCP connections are pooled across lookups until close.
+        Raises a ValueError if retries is less than 1 or timeout not positive.
+        """
+        check_limits(timeout, retries)
+        self.servers = [servers] if isinstance(servers, str) else list(servers)
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.edns_payload_size = edns_payload_size
+        self.cache = cache
+        self.cache_lock = threading.Lock()
+        self.rtt = rtt_estimation.RttTable()
+        self.udp_pool = transport.UdpSocketPool()
+        self.tcp_pool = transport.TcpConnectionPool()
+
+    def close(self):
+        self.udp_pool.close()
+        self.tcp_pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def cache_put(self, name, qtype, dns_response):
+        if self.cache is not None:
+            with self.cache_lock:
+                self.cache.put(name, qtype, 0x0001, dns_response)
+
+    def ranked_servers(self):
+        # healthiest servers first, as for RacingResolver
+        return sorted(
+            self.servers, key=lambda server: self.rtt.get(server, self.port).score()
+        )
+
+    def resolve(self, name, qtype=0x0001):
+        """
+        Looks up the records of a type (code or name) for a name.
+        Returns a LookupResult, raises a DnsError if there is no valid answer:
+        NameNotFoundError if the name does not exist, DnsTimeoutError if no
+        server answered. Timeouts, unreachable servers, server failures,
+        refusals and invalid responses move on to the next server.
+        """
+        qtype = qtype_code(qtype)
+        start_time = time.perf_counter()
+
+        if self.cache is not None:
+            with self.cache_lock:
+                cached_response = self.cache.get(name, qtype)
+            if cached_response is not None:
+                check_response(name, cached_response)
+                latency = time.perf_counter() - start_time
+                return LookupResult(name, qtype, "cache", cached_response, latency, 0)
+
+        last_error = DnsTimeoutError(f"No DNS server to query for {name}")
+        for server in self.ranked_servers():
+            estimator = self.rtt.get(server, self.port)
+            dns_query = query.DnsQuery(
+                name, qtype, edns_payload_size=self.edns_payload_size
+            )
+            try:
+                raw_response, retries_left = dns_query.send(
+                    server,
+                    self.port,
+                    self.timeout,
+                    self.retries,
+                    self.udp_pool,
+                    self.rtt,
+                    self.tcp_pool,
+                )
+            except OSError as error:
+                estimator.failed()
+                last_error = DnsConnectionError(f"{server}: {error}")
+                continue
+            if raw_response is None:
+                estimator.failed()
+                last_error = DnsTimeoutError(
+                    f"Maximum number of retries {self.retries} exceeded on {server}"
+                )
+                continue
+
+            try:
+                dns_response = response.DnsResponse(raw_response)
+            except response.MalformedResponseError as error:  # e.g. no header
+                estimator.failed()
+                last_error = malformed(error)
+                continue
+            try:
+                check_response(name, dns_response)
+            except NameNotFoundError:
+                # the name does not exist on any server, remember it (RFC 2308)
+                self.cache_put(name, qtype, dns_response)
+                raise
+            except DnsResponseError as error:
+                if error.rcode not in FAILOVER_RCODES:
+                    raise  # the query itself is at fault, on every server
+                estimator.failed()
+                last_error = error
+                continue
+            except (MalformedResponseError, UnexpectedResponseError) as error:
+                estimator.failed()
+                last_error = error
+                continue
+
+            self.cache_put(name, qtype, dns_response)
+            latency = time.perf_counter() - start_time
+            retries = self.retries - retries_left - 1
+            return LookupResult(name, qtype, server, dns_response, latency, retries)
+
+        raise last_error
+
+
+def resolve(
+    name, qtype, servers, timeout=5, retries=3, port=53, edns_payload_size=None
+):
+    """
+    Looks up the records of a type (code or name) for a name on the given
+    servers, see Resolver.resolve. Use a Resolver to reuse its sockets
+    across lookups.
+    """
+    with Resolver(servers, port, timeout, retries, edns_payload_size) as resolver:
+        return resolver.resolve(name, qtype)
+
+
+async def resolve_async(
+    name, qtype, servers, timeout=5, retries=3, port=53, edns_payload_size=None
+):
+    """
+    Looks up the records of a type for a name from asyncio code, racing the
+    query across the servers (see RacingResolver). Returns a LookupResult,
+    raises the same errors as Resolver.resolve.
+    """
+    check_limits(timeout, retries)
+    qtype = qtype_code(qtype)
+    servers = [servers] if isinstance(servers, str) else list(servers)
+    start_time = time.perf_counter()
+    try:
+        async with async_resolver.RacingResolver(
+            servers, port, timeout, retries, edns_payload_size=edns_payload_size
+        ) as resolver:
+            dns_response, used_retries, server = await resolver.race(name, qtype)
+    except TimeoutError as error:
+        raise DnsTimeoutError(str(error)) from error
+    except OSError as error:  # e.g. the socket could not be created
+        raise DnsConnectionError(str(error)) from error
+    except response.MalformedResponseError as error:
+        raise malformed(error) from error
+
+    check_response(name, dns_response)
+    latency = time.perf_counter() - start_time
+    return LookupResult(name, qtype, server, dns_response, latency, used_retries)
@@ -0,0 +1,197 @@
+import bisect
+import threading
+
+# upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 1232, 2048, 4096, 65535)
+
+# status of a query by response code, for the query counter
+RCODE_STATUSES = {
+    0: "noerror",
+    1: "formerr",
+    2: "servfail",
+    3: "nxdomain",
+    4: "notimp",
+    5: "refused",
+}
+
+
+def format_labels(labels):
+    """
+    Formats label pairs in the Prometheus text format, e.g. {status="noerror"}
+    """
+    if not labels:
+        return ""
+    escaped = [
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels
+    ]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value):
+    # integral values without a trailing .0
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    def __init__(self, name, help):
+        """
+        Initializes a counter with:
+        - values: Maps each set of label pairs (sorted tuple) to its count
+        """
+        self.name = name
+        self.help = help
+        self.type = "counter"
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        if not self.values:
+            yield self.name, (), 0
+        for labels, value in sorted(self.values.items()):
+            yield self.name, labels, value
+
+
+class Gauge(Counter):
+    def __init__(self, name, help):
+        super().__init__(name, help)
+        self.type = "gauge"
+
+    def set(self, value, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        """
+        Initializes a histogram with:
+        - buckets: Sorted upper bounds of the buckets (+Inf is added)
+        - counts: Number of observations in each bucket, not cumulated
+        """
+        self.name = name
+        self.help = help
+        self.type = "histogram"
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulated = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulated += count
+            le = "+Inf" if bound == float("inf") else format_value(bound)
+            yield self.name + "_bucket", (("le", le),), cumulated
+        yield self.name + "_sum", (), self.sum
+        yield self.name + "_count", (), self.count
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        Initializes an in-process registry of metrics, by name
+        """
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        # a metric registered twice is shared
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help))
+
+    def gauge(self, name, help):
+        return self.register(Gauge(name, help))
+
+    def histogram(self, name, help, buckets):
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class ResolverMetrics:
+    def __init__(self, registry=None):
+        """
+        Initializes the metrics of the queries resolved by the client
+        in a registry (a new one if not given)
+        """
+        self.registry = registry if registry is not None else MetricsRegistry()
+        self.queries = self.registry.counter(
+            "dns_queries_total", "Queries resolved, by status"
+        )
+        self.retries = self.registry.counter(
+            "dns_retries_total", "Queries sent again after a timeout"
+        )
+        self.timeouts = self.registry.counter(
+            "dns_timeouts_total", "Queries left unanswered after every retry"
+        )
+        self.latency = self.registry.histogram(
+            "dns_query_latency_seconds", "Time to resolve a query", LATENCY_BUCKETS
+        )
+        self.response_size = self.registry.histogram(
+            "dns_response_size_bytes", "Size of the responses", SIZE_BUCKETS
+        )
+        self.cache_hits = self.registry.counter(
+            "dns_cache_hits_total", "Questions answered from the cache"
+        )
+        self.cache_misses = self.registry.counter(
+            "dns_cache_misses_total", "Questions not found in the cache"
+        )
+        self.cache_hit_ratio = self.registry.gauge(
+            "dns_cache_hit_ratio", "Share of the cache lookups that were hits"
+        )
+
+    def observe_response(self, latency, retries, dns_response):
+        status = RCODE_STATUSES.get(dns_response.header.rcode, "other")
+        self.queries.inc(status=status)
+        self.retries.inc(retries)
+        self.latency.observe(latency)
+        self.response_size.observe(len(dns_response.raw_response))
+
+    def observe_failure(self, latency, retries, error):
+        timed_out = isinstance(error, TimeoutError)
+        self.queries.inc(status="timeout" if timed_out else "error")
+        if timed_out:
+            self.timeouts.inc()
+        self.retries.inc(retries)
+        self.latency.observe(latency)
+
+    def observe_cache(self, hits, misses):
+        self.cache_hits.inc(hits)
+        self.cache_misses.inc(misses)
+        lookups = self.cache_hits.get() + self.cache_misses.get()
+        self.cache_hit_ratio.set(self.cache_hits.get() / lookups if lookups else 0.0)
+
+    def render(self):
+        return self.registry.render()
@@ -0,0 +1,134 @@
+import asyncio
+import random
+import socket
+import struct
+import DnsForwarder as forwarder
+import DnsResponse as response
+
+
+class MockDnsServer:
+    def __init__(self, latency=0.0, loss=0.0, truncation=0.0, answers=1, ttl=300):
+        """
+        Initializes a mock authoritative DNS server answering every A query,
+        with:
+        - latency: Seconds waited before sending each response
+        - loss: Fraction of UDP queries dropped without a response
+        - truncation: Fraction of UDP responses replaced by an empty truncated
+          one (TC flag set), so the query is sent again over TCP
+        - answers: Number of A records of each response (sets its size)
+        - ttl: TTL of the records
+        Responses larger than the client's UDP payload size are truncated too.
+        """
+        self.latency = latency
+        self.loss = loss
+        self.truncation = truncation
+        self.answers = answers
+        self.ttl = ttl
+
+        # statistics
+        self.queries = 0
+        self.dropped = 0
+        self.truncated = 0
+
+    def response(self, data, over_udp=True):
+        """
+        Returns the response to a query, None to drop it
+        """
+        self.queries += 1
+        try:
+            request = response.DnsResponse(data)
+            question_end = request.section_offset("answers")
+            qtype = request.question.rtype
+            max_size = forwarder.client_payload_size(request) if over_udp else 65535
+        except response.MalformedResponseError:
+            return None
+
+        if over_udp and random.random() < self.loss:
+            self.dropped += 1
+            return None
+
+        # A records, their name pointing at the question (offset 12)
+        records = b""
+        count = self.answers if qtype == 0x0001 else 0
+        for i in range(count):
+            address = bytes((10, (i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF))
+            records += struct.pack(">HHHIH", 0xC00C, 1, 1, self.ttl, 4) + address
+
+        flags = 0x8400 | (request.header.rd << 8)  # QR, AA, RD copied
+        truncated = over_udp and (
+            random.random() < self.truncation or question_end + len(records) > max_size
+        )
+        if truncated:
+            self.truncated += 1
+            flags |= 0x0200  # TC
+            count, records = 0, b""
+
+        header = struct.pack(">HHHHHH", request.header.id, flags, 1, count, 0, 0)
+        return header + data[12:question_end] + records
+
+
+class MockUdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        raw_response = self.server.response(data)
+        if raw_response is None:
+            return
+        # responses are delayed independently of each other
+        loop = asyncio.get_running_loop()
+        loop.call_later(self.server.latency, self.transport.sendto, raw_response, addr)
+
+
+async def serve_tcp_client(server, reader, writer):
+    try:
+        while True:
+            length = struct.unpack(">H", await reader.readexactly(2))[0]
+            raw_response = server.response(await reader.readexactly(length), False)
+            if raw_response is None:
+                break
+            await asyncio.sleep(server.latency)
+            writer.write(struct.pack(">H", len(raw_response)) + raw_response)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(server, address="127.0.0.1", port=0, ready=None):
+    """
+    Serves the mock server over UDP and TCP on the same port (a free one for
+    port 0) until cancelled, putting the port in the ready queue once listening
+    """
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: MockUdpProtocol(server), local_addr=(address, port)
+    )
+    port = transport.get_extra_info("sockname")[1]
+    tcp_server = await asyncio.start_server(
+        lambda reader, writer: serve_tcp_client(server, reader, writer),
+        address,
+        port,
+        family=socket.AF_INET,
+    )
+    if ready is not None:
+        ready.put(port)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        transport.close()
+        tcp_server.close()
+
+
+def run(ready, address="127.0.0.1", port=0, **options):
+    """
+    Runs a mock server with the given options (those of MockDnsServer),
+    e.g. in its own process so its CPU time is not counted as the client's
+    """
+    asyncio.run(serve(MockDnsServer(**options), address, port, ready))
@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+# default fraction of its TTL after which a hot entry is refreshed
+PREFETCH_FRACTION = 0.8
+
+# default maximum number of refreshes sent per second
+PREFETCH_RATE = 10.0
+
+# hits an entry needs, since it was cached, to be considered hot
+PREFETCH_MIN_HITS = 2
+
+# maximum number of questions whose hits are counted, the counts are reset above it
+MAX_TRACKED_QUESTIONS = 65536
+
+
+class Prefetcher:
+    def __init__(
+        self,
+        cache,
+        fraction=PREFETCH_FRACTION,
+        rate=PREFETCH_RATE,
+        min_hits=PREFETCH_MIN_HITS,
+    ):
+        """
+        Initializes refresh-ahead prefetching of the hot entries of a cache with:
+        - fraction: Fraction of its TTL after which a hit on an entry refreshes it
+        - rate: Maximum number of refreshes per second (token bucket of rate tokens)
+        - min_hits: Number of hits an entry needs before it is refreshed
+        - hits: Number of hits of each question since it was last refreshed
+        - refreshing: Questions being refreshed in the background
+        """
+        self.cache = cache
+        self.fraction = fraction
+        self.rate = rate
+        self.min_hits = min_hits
+        self.hits = {}
+        self.refreshing = set()
+        self.tasks = set()
+
+        # token bucket limiting the refreshes sent upstream
+        self.tokens = max(rate, 1.0)
+        self.updated_at = time.monotonic()
+
+        # statistics
+        self.prefetches = 0
+        self.rate_limited = 0
+        self.failures = 0
+
+    def take_token(self):
+        """
+        Takes a token from the bucket, refilled at rate tokens per second.
+        Returns False if it is empty.
+        """
+        now = time.monotonic()
+        capacity = max(self.rate, 1.0)
+        self.tokens = min(self.tokens + (now - self.updated_at) * self.rate, capacity)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def hit(self, domain, qtype, qclass, refresh):
+        """
+        Counts a cache hit on a question. If the entry is hot and past the
+        fraction of its TTL, refreshes it in the background by calling the
+        coroutine function refresh(domain, qtype, qclass), which must query
+        the upstream servers (bypassing the cache) and cache the response.
+        """
+        key = (domain.lower().rstrip("."), qtype, qclass)
+        if len(self.hits) >= MAX_TRACKED_QUESTIONS and key not in self.hits:
+            self.hits.clear()
+        hits = self.hits[key] = self.hits.get(key, 0) + 1
+        if hits < self.min_hits or key in self.refreshing:
+            return
+
+        elapsed = self.cache.lifetime_elapsed(domain, qtype, qclass)
+        if elapsed is None or elapsed < self.fraction:
+            return
+        if not self.take_token():
+            self.rate_limited += 1
+            return
+
+        # the entry must be hot again before its next refresh
+        del self.hits[key]
+        self.refreshing.add(key)
+        self.prefetches += 1
+        task = asyncio.ensure_future(refresh(domain, qtype, qclass))
+        self.tasks.add(task)
+        task.add_done_callback(lambda task: self.refreshed(key, task))
+
+    def refreshed(self, key, task):
+        self.refreshing.discard(key)
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.failures += 1  # the entry just expires as usual
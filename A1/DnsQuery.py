@@ -1,7 +1,38 @@
+import functools
 import random
 import struct
 import socket
-import dnsClient as client
+import time
+import DnsTransport as transport
+
+# number of encoded questions kept by encode_question
+QUESTION_CACHE_SIZE = 4096
+
+
+def encode_name(domain):
+    """
+    Encodes a domain name, uncompressed, according to the DNS protocol.
+    Each label is prefixed with its length, and the domain ends with a null byte (0x00).
+    Empty labels are skipped, so fully qualified names ("mcgill.ca.") and the
+    root domain ("" or ".") are encoded correctly.
+    """
+    encoded_name = bytearray()
+    for label in domain.split("."):
+        if label:
+            encoded_label = label.encode("utf-8")
+            encoded_name.append(len(encoded_label))
+            encoded_name += encoded_label
+    encoded_name.append(0)  # Null byte to signal the end of the domain name
+    return bytes(encoded_name)
+
+
+@functools.lru_cache(maxsize=QUESTION_CACHE_SIZE)
+def encode_question(domain, qtype, qclass):
+    """
+    Encodes a question section (QNAME, QTYPE, QCLASS), cached for each
+    (domain, qtype, qclass) so repeated lookups skip the encoding.
+    """
+    return encode_name(domain) + struct.pack(">HH", qtype, qclass)
 
 
 class DnsHeader:
@@ -69,70 +100,157 @@ class DnsQuestion:
     def encode_domain_name(self):
         """
         Encodes the domain name (QNAME) according to the DNS protocol.
-        Each label is prefixed with its length, and the domain ends with a null byte (0x00).
         """
-        labels = self.domain.split(".")
-        encoded_name = b""
-        for label in labels:
-            encoded_name += struct.pack("B", len(label)) + label.encode("utf-8")
-        encoded_name += b"\x00"  # Null byte to signal the end of the domain name
-        return encoded_name
+        return self.build()[:-4]
 
     def build(self):
         """
-        Builds the complete DNS Question section:
+        Builds the complete DNS Question section (cached by encode_question):
         - QNAME: Encoded domain name
         - QTYPE: 16-bit type of query
         - QCLASS: 16-bit class of query
         """
-        qname = self.encode_domain_name()
-        qtype_qclass = struct.pack(">HH", self.qtype, self.qclass)
-        return qname + qtype_qclass
+        return encode_question(self.domain, self.qtype, self.qclass)
+
+
+class DnsOptRecord:
+    def __init__(self, payload_size):
+        """
+        Initializes an EDNS0 OPT pseudo-record (RFC 6891) with:
+        - payload_size: Largest UDP response, in bytes, the client can receive
+        """
+        self.payload_size = payload_size
+
+    def build(self):
+        """
+        Builds the OPT record of the Additional section:
+        - NAME: Root domain (0x00)
+        - TYPE: 41 (OPT)
+        - CLASS: UDP payload size
+        - TTL: Extended RCODE, version and flags (all 0)
+        - RDLENGTH: 0, no options
+        """
+        return b"\x00" + struct.pack(">HHIH", 41, self.payload_size, 0, 0)
 
 
 class DnsQuery:
-    def __init__(self, domain, qtype, qclass=0x0001):
+    def __init__(self, domain, qtype, qclass=0x0001, edns_payload_size=None):
         # Create instances of DnsHeader and DnsQuestion
         self.header = DnsHeader()
         self.question = DnsQuestion(domain, qtype, qclass)
 
+        # Packet template, built once and then only patched with the current ID
+        self.packet = None
+
+        # Advertise a larger UDP payload size with an EDNS0 OPT record
+        self.opt = None
+        if edns_payload_size is not None:
+            self.opt = DnsOptRecord(edns_payload_size)
+            self.header.arcount = 1
+
     def build(self):
         """
-        Build the full DNS packet (Header + Question)
+        Build the full DNS packet (Header + Question [+ OPT record]).
+        The packet is built into a bytearray template on the first call, later
+        calls (retries, new transaction IDs) only patch the 2-byte ID in place,
+        so header fields other than the ID must be set before the first build.
         """
-        header_packet = self.header.build()
-        question_packet = self.question.build()
-        return header_packet + question_packet
+        if self.packet is None:
+            self.packet = bytearray(self.header.build())
+            self.packet += self.question.build()
+            if self.opt is not None:
+                self.packet += self.opt.build()
+        else:
+            struct.pack_into(">H", self.packet, 0, self.header.id)
+        return self.packet
+
+    def udp_payload_size(self):
+        # largest UDP response that can be received for this query
+        if self.opt is None:
+            return 512
+        return max(self.opt.payload_size, 512)
+
+    def send_tcp(self, dns_server, port, timeout, tcp_pool=None):
+        """
+        Sends the DNS query over TCP and returns the response,
+        reusing a kept-alive connection of tcp_pool if given
+        """
+        query_packet = self.build()
+        if tcp_pool is None:
+            return transport.tcp_query(
+                dns_server, port, query_packet, self.header.id, timeout
+            )
+        return tcp_pool.exchange(
+            dns_server, port, query_packet, self.header.id, timeout
+        )
 
-    def send(self, dns_server, port, timeout, max_retries):
+    def send(
+        self,
+        dns_server,
+        port,
+        timeout,
+        max_retries,
+        pool=None,
+        rtt=None,
+        tcp_pool=None,
+    ):
         """
         Sends the DNS query to the specified DNS server and returns the response.
+        - pool: Optional UdpSocketPool to take a long-lived socket from,
+          otherwise a single socket is created for all attempts of this query
+        - rtt: Optional RttTable, each attempt then waits for the server's adaptive
+          timeout with exponential backoff, timeout only being the upper bound
+        - tcp_pool: Optional TcpConnectionPool for the TCP fallback
+        If the UDP response is truncated (TC flag set), the query is sent again over TCP.
         """
-        # Create a UDP socket
-        i = 1
-        retries = max_retries
-        while retries != 0:
-            i += 1
-            retries -= 1
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                sock.settimeout(timeout)
+        # Get a UDP socket connected to the DNS server
+        if pool is None:
+            sock = transport.new_udp_socket(dns_server, port)
+        else:
+            sock = pool.acquire(dns_server, port)
 
-                # Build the DNS query packet
-                query_packet = self.build()
+        estimator = None if rtt is None else rtt.get(dns_server, port)
 
-                # Send the packet to the DNS server
-                sock.sendto(query_packet, (dns_server, port))
+        # Build the DNS query packet once, retries resend the same packet
+        query_packet = self.build()
 
-                # Receive the response from the DNS server
-                response, _ = sock.recvfrom(512)  # Buffer size is 512 bytes
+        retries = max_retries
+        try:
+            while retries > 0:
+                retries -= 1
+                attempt = max_retries - retries - 1
+                try:
+                    # Send the packet to the DNS server
+                    sock.send(query_packet)
 
-                # after receiving packet, close socket
-                sock.close()
+                    # Receive the response from the DNS server
+                    sent_at = time.perf_counter()
+                    if estimator is None:
+                        attempt_timeout = timeout
+                    else:
+                        attempt_timeout = estimator.timeout(attempt, timeout)
+                    response = transport.receive_response(
+                        sock, self.header.id, attempt_timeout, self.udp_payload_size()
+                    )
 
-                return response, retries
+                    # only a response to a query sent once is an RTT sample
+                    if estimator is not None and attempt == 0:
+                        estimator.update(time.perf_counter() - sent_at)
 
-            except socket.timeout:
-                if retries == 0:
-                    client.print_error(max_retries, "maxretries")
-                    return None, retries  # If retries are exhausted, return None
+                    # the answer did not fit in a UDP response, fall back to TCP
+                    if transport.is_truncated(response):
+                        response = self.send_tcp(dns_server, port, timeout, tcp_pool)
+
+                    return response, retries
+
+                # a refused (ICMP port unreachable) or reset attempt is retried
+                # like a timeout
+                except (socket.timeout, ConnectionError):
+                    pass
+            return None, 0  # If retries are exhausted (or none allowed), return None
+        finally:
+            # always close the socket (or return it to the pool), even on errors
+            if pool is None:
+                sock.close()
+            else:
+                pool.release(dns_server, port, sock)
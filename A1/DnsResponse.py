@@ -1,232 +1,501 @@
+import copy
 import struct
-import dnsClient as client
+import sys
+import DnsQuery as query
+
+# sections of resource records, in the order they appear in a response
+SECTIONS = ["answers", "authority", "additional"]
+
+# limits on a compressed domain name, bounding the work on hostile responses
+MAX_POINTER_HOPS = 64
+MAX_NAME_LENGTH = 255
+
+
+class MalformedResponseError(ValueError):
+    """
+    The response could not be decoded (truncated, or with an invalid name or record),
+    the only error raised decoding a response
+    """
+
+
+def check_bounds(raw_response, end, what):
+    """
+    Raises a MalformedResponseError if the response ends before offset end,
+    where what ends
+    """
+    if end > len(raw_response):
+        raise MalformedResponseError(f"Malformed response: truncated {what}")
+
+
+class Header:
+    """
+    DNS response header, with the flags unpacked into their own fields
+    """
+
+    __slots__ = (
+        "id",
+        "qr",
+        "opcode",
+        "aa",
+        "tc",
+        "rd",
+        "ra",
+        "z",
+        "rcode",
+        "qdcount",
+        "ancount",
+        "nscount",
+        "arcount",
+    )
+
+    def __init__(self, id, flags, qdcount, ancount, nscount, arcount):
+        self.id = id  # Transaction ID
+        self.qr = flags >> 15  # QR: bit 15
+        self.opcode = (flags >> 11) & 0b1111  # opcode: bits 11-14
+        self.aa = (flags >> 10) & 0b1  # aa: bit 10
+        self.tc = (flags >> 9) & 0b1  # tc: bit 9
+        self.rd = (flags >> 8) & 0b1  # rd: bit 8
+        self.ra = (flags >> 7) & 0b1  # ra: bit 7
+        self.z = (flags >> 4) & 0b111  # z: bits 4-6
+        self.rcode = flags & 0b1111  # rcode: bit 0-3
+        self.qdcount = qdcount  # Number of questions
+        self.ancount = ancount  # Number of answer records
+        self.nscount = nscount  # Number of authority records
+        self.arcount = arcount  # Number of additional records
+
+
+class Question:
+    """
+    Question a DNS response pertains to
+    """
+
+    __slots__ = ("domain", "rtype", "rclass")
+
+    def __init__(self, domain, rtype, rclass):
+        self.domain = domain
+        self.rtype = rtype
+        self.rclass = rclass
+
+
+class StartOfAuthority:
+    """
+    Rdata of an SOA record, found in the authority section of negative responses
+    """
+
+    __slots__ = ("mname", "rname", "serial", "refresh", "retry", "expire", "minimum")
+
+    def __init__(self, mname, rname, serial, refresh, retry, expire, minimum):
+        self.mname = mname  # Primary nameserver of the zone
+        self.rname = rname  # Mailbox of the zone's administrator
+        self.serial = serial
+        self.refresh = refresh
+        self.retry = retry
+        self.expire = expire
+        self.minimum = minimum  # TTL of negative responses (RFC 2308)
+
+    def __str__(self):
+        return (
+            f"{self.mname} {self.rname} {self.serial} {self.refresh} "
+            f"{self.retry} {self.expire} {self.minimum}"
+        )
+
+
+class ResourceRecord:
+    """
+    Resource record, with its rdata stored in native form:
+    - A: The packed 4-byte IPv4 address
+    - NS, CNAME: The interned domain name
+    - MX: The interned domain name of the exchange, its preference in preference
+    - SOA: A StartOfAuthority
+    """
+
+    __slots__ = ("domain_name", "rtype", "rclass", "ttl", "rdata", "preference")
+
+    def __init__(self, domain_name, rtype, rclass, ttl, rdata, preference=-1):
+        self.domain_name = domain_name
+        self.rtype = rtype
+        self.rclass = rclass
+        self.ttl = ttl
+        self.rdata = rdata
+        self.preference = preference  # -1 if not an MX record
+
+    def rdata_text(self):
+        # rdata in presentation format (dotted-decimal for IPv4 addresses)
+        if self.rtype == 0x0001:
+            return ".".join(map(str, self.rdata))
+        if self.rtype == 0x0006:
+            return str(self.rdata)
+        return self.rdata
+
+    def encode(self):
+        """
+        Encodes the record in wire format, its names uncompressed
+        """
+        if self.rtype == 0x0001:
+            rdata = bytes(self.rdata)
+        elif self.rtype == 0x000F:
+            rdata = struct.pack(">H", self.preference) + query.encode_name(self.rdata)
+        elif self.rtype == 0x0006:
+            soa = self.rdata
+            rdata = (
+                query.encode_name(soa.mname)
+                + query.encode_name(soa.rname)
+                + struct.pack(
+                    ">IIIII",
+                    soa.serial,
+                    soa.refresh,
+                    soa.retry,
+                    soa.expire,
+                    soa.minimum,
+                )
+            )
+        else:  # NS, CNAME
+            rdata = query.encode_name(self.rdata)
+        return (
+            query.encode_name(self.domain_name)
+            + struct.pack(">HHIH", self.rtype, self.rclass, self.ttl, len(rdata))
+            + rdata
+        )
+
+    def with_ttl(self, ttl):
+        # copy of the record with another TTL
+        return ResourceRecord(
+            self.domain_name, self.rtype, self.rclass, ttl, self.rdata, self.preference
+        )
+
+    def __repr__(self):
+        return (
+            f"ResourceRecord({self.domain_name!r}, {self.rtype}, {self.rclass}, "
+            f"{self.ttl}, {self.rdata_text()!r}, {self.preference})"
+        )
+
+
+def lazy_section(section):
+    """
+    Creates the property of a section of records, decoded on first access
+    """
+
+    def get_records(self):
+        if section not in self.decoded_sections:
+            self.decoded_sections[section] = list(self.iter_section(section))
+        return self.decoded_sections[section]
+
+    def set_records(self, records):
+        # replaces the records of this response only, see DnsResponse.copy
+        self.decoded_sections[section] = records
+
+    return property(get_records, set_records)
 
 
 class DnsResponse:
+    # records of each section, as lists of ResourceRecord
+    answers = lazy_section("answers")
+    authority = lazy_section("authority")
+    additional = lazy_section("additional")
+
     def __init__(self, raw_response):
         """
-        Initializes a DNS Response structure with:
-        - domain: The domain name to which the record pertains (e.g., "www.mcgill.ca").
-        - question:
-        -
-        -
-        """
-        # header
-        self.header = {
-            "id": None,
-            "flags": {
-                "qr": None,
-                "opcode": None,
-                "aa": None,
-                "tc": None,
-                "rd": None,
-                "ra": None,
-                "z": None,
-                "rcode": None,
-            },
-            "qdcount": None,
-            "ancount": None,
-            "nscount": None,
-            "arcount": None,
-        }
-
-        # question
-        self.question = {"domain": None, "rtype": None, "rclass": None}
-
-        # answer
-        self.answers = []
-        self.answer_keys = [
-            "domain_name",
-            "rtype",
-            "rclass",
-            "ttl",
-            "rdlength",
-            "rdata",
-            "rdata_preference",
-        ]
-
-        # additional
-        self.additionals = []
-
-        # parse dns response
+        Initializes a DNS Response structure over a memoryview of the raw response.
+        Only the header is decoded right away, the rest is decoded on first access:
+        - header: Transaction ID, flags and the number of records of each section
+        - question: The domain name, rtype and rclass the response pertains to
+        - answers, authority, additional: The records of each section
+        Records can also be iterated one at a time with iter_section.
+        """
+        # header, decoded right away
+        self.header = None
+
+        # raw response, kept to be cached in wire format
+        self.raw_response = raw_response
+        self.view = memoryview(raw_response)
+
+        # lazily decoded question and sections, and where each section starts
+        self.decoded_question = None
+        self.decoded_sections = {}
+        self.section_offsets = {}
+
+        # decoded name suffixes of this message and their length in bytes,
+        # by offset, so each is decoded once
+        self.name_memo = {}
+
+        # parse dns response header
         self.decode_response(raw_response)
 
+    def copy(self):
+        """
+        Returns a copy sharing the raw response and decoded names of this one,
+        but with its own header and decoded sections, so records and counts set
+        on the copy (e.g. aged TTLs) leave this response unchanged
+        """
+        response_copy = copy.copy(self)
+        response_copy.header = copy.copy(self.header)
+        response_copy.decoded_sections = dict(self.decoded_sections)
+        return response_copy
+
     def decode_domain_name(self, raw_response, offset):
         """
         Decodes the domain name (RNAME) according to the DNS protocol.
+        Compression pointers are followed iteratively, at most MAX_POINTER_HOPS
+        times (so pointer loops end), and every suffix decoded is memoized by
+        offset, so names pointing at an already decoded suffix stop there.
+        Returns the name and the offset right after it in the record.
+        Raises a MalformedResponseError if the name is malformed or runs past
+        the response.
         """
-        labels = []
+        labels = []  # (offset, label) of the labels decoded
+        end_offset = None  # set once the end of the name in the record is known
+        position = offset
+        name_length = 0
+        hops = 0
 
         while True:
-            label_length = raw_response[offset]
+            # suffix already decoded: the name ends with it
+            if position in self.name_memo:
+                suffix, suffix_length = self.name_memo[position]
+                name_length += suffix_length
+                if name_length > MAX_NAME_LENGTH:
+                    raise MalformedResponseError(
+                        "Malformed response: domain name too long"
+                    )
+                if end_offset is None:
+                    end_offset = self.skip_domain_name(raw_response, position)
+                break
+
+            check_bounds(raw_response, position + 1, "domain name")
+            label_length = raw_response[position]
 
             # if length = 0, then it marks the end of the domain name
             if label_length == 0:
-                offset += 1  # zero octet terminator is 1 byte
+                suffix, suffix_length = "", 0
+                if end_offset is None:
+                    end_offset = position + 1  # zero octet terminator is 1 byte
                 break
             # if length >= 0xC0 (first two bits set to 1), then it's a pointer (compressed name)
             elif label_length >= 0xC0:
-                pointer = (
-                    struct.unpack(">H", raw_response[offset : offset + 2])[0] & 0x3FFF
+                hops += 1
+                if hops > MAX_POINTER_HOPS:
+                    raise MalformedResponseError(
+                        "Malformed response: compression pointer loop"
+                    )
+                check_bounds(raw_response, position + 2, "compression pointer")
+                if end_offset is None:
+                    end_offset = position + 2  # pointer is 2 bytes
+                # continue decoding from where pointer indicates
+                position = struct.unpack_from(">H", raw_response, position)[0] & 0x3FFF
+            # lengths 0x40-0xBF are reserved label types
+            elif label_length >= 0x40:
+                raise MalformedResponseError(
+                    "Malformed response: unsupported label type"
                 )
-                # decode name starting from where pointer indicates
-                labels.append(self.decode_domain_name(raw_response, pointer)[0])
-                offset += 2  # pointer is 2 bytes
-                break
             # else, it's a normal label
             else:
-                offset += 1  # label length indicator is 1 byte
-                labels.append(
-                    raw_response[offset : offset + label_length].decode("utf-8")
-                )
-                offset += label_length  # increment offset by label length
-
-        decoded_name = ".".join(labels)
-        return decoded_name, offset
+                name_length += label_length + 1
+                if name_length > MAX_NAME_LENGTH:
+                    raise MalformedResponseError(
+                        "Malformed response: domain name too long"
+                    )
+                check_bounds(raw_response, position + 1 + label_length, "label")
+                label = raw_response[position + 1 : position + 1 + label_length]
+                try:
+                    labels.append((position, str(label, "utf-8")))
+                except UnicodeDecodeError:
+                    raise MalformedResponseError(
+                        "Malformed response: label is not UTF-8"
+                    ) from None
+                position += 1 + label_length  # length indicator is 1 byte
 
-    def decode_answer(self, ancount, raw_response, offset):
-        answers = []
+        # build the name from its last label, memoizing the suffix at each label
+        # (names repeat across records and responses, intern them to share one copy)
+        decoded_name = suffix
+        decoded_length = suffix_length
+        for label_offset, label in reversed(labels):
+            if decoded_name:
+                decoded_name = sys.intern(label + "." + decoded_name)
+            else:
+                decoded_name = sys.intern(label)
+            decoded_length += raw_response[label_offset] + 1
+            self.name_memo[label_offset] = (decoded_name, decoded_length)
 
-        for i in range(ancount):
+        return decoded_name, end_offset
 
-            domain_name, offset = self.decode_domain_name(raw_response, offset)
-            rtype, rclass, ttl, rdlength = struct.unpack(
-                ">HHIH", raw_response[offset : offset + 10]
-            )
-            offset += 10
-
-            rdata = ""
-            preference = -1  # default is no preference, not MX-query
-            # if 0x0001, then type-A (host-address)
-            # and it's the IP-address (4 octets)
-            if rtype == 0x0001:
-                rdata = struct.unpack(">BBBB", raw_response[offset : offset + rdlength])
-                rdata = ".".join(map(str, rdata))
-            # if 0x0002, then type-NS (name server)
-            # and it's the name of the server in same format as QNAME
-            elif rtype == 0x0002:
-                rdata, _ = self.decode_domain_name(raw_response, offset)
-            # if 0x0005, then CNAME
-            # and it's the name of the alias in same format as QNAME
-            elif rtype == 0x0005:
-                rdata, _ = self.decode_domain_name(raw_response, offset)
-            # if 0x000F, MX-query (mail server)
-            # then it has preference (2 bytes) and exchange (in same format as QNAME)
-            elif rtype == 0x000F:
-                preference = struct.unpack(">H", raw_response[offset : offset + 2])[0]
-                exchange, _ = self.decode_domain_name(raw_response, offset + 2)
-                rdata = exchange
-            else:
-                offset += rdlength
-                continue
+    def skip_domain_name(self, raw_response, offset):
+        """
+        Returns the offset right after a domain name, without decoding it
+        """
+        while True:
+            check_bounds(raw_response, offset + 1, "domain name")
+            label_length = raw_response[offset]
+            if label_length == 0:
+                return offset + 1
+            elif label_length >= 0xC0:
+                check_bounds(raw_response, offset + 2, "compression pointer")
+                return offset + 2
+            offset += 1 + label_length
 
-            offset += rdlength
+    def decode_record(self, raw_response, offset):
+        """
+        Decodes the resource record at offset.
+        Returns the record (None if its rtype is not supported or its rclass
+        is not Internet) and the offset of the next record.
+        """
+        domain_name, offset = self.decode_domain_name(raw_response, offset)
+        check_bounds(raw_response, offset + 10, "record")
+        rtype, rclass, ttl, rdlength = struct.unpack_from(">HHIH", raw_response, offset)
+        offset += 10
+        next_offset = offset + rdlength
+        check_bounds(raw_response, next_offset, "record data")
 
-            # error handling: ensure response answer rclass flag is 0x0001
-            if rclass != 0x0001:
-                client.print_error(
-                    "Response answer class is not set to 0x0001, Internet class",
-                    "unexpected",
+        rdata = ""
+        preference = -1  # default is no preference, not MX-query
+        # if 0x0001, then type-A (host-address)
+        # and it's the IP-address (4 octets), kept packed
+        if rtype == 0x0001:
+            if rdlength != 4:
+                raise MalformedResponseError(
+                    "Malformed response: A record data is not 4 bytes"
+                )
+            # copied out of the memoryview, so a record kept (e.g. in a cache)
+            # does not pin the whole raw response
+            rdata = bytes(raw_response[offset : offset + 4])
+        # if 0x0002, then type-NS (name server)
+        # and it's the name of the server in same format as QNAME
+        elif rtype == 0x0002:
+            rdata, _ = self.decode_domain_name(raw_response, offset)
+        # if 0x0005, then CNAME
+        # and it's the name of the alias in same format as QNAME
+        elif rtype == 0x0005:
+            rdata, _ = self.decode_domain_name(raw_response, offset)
+        # if 0x000F, MX-query (mail server)
+        # then it has preference (2 bytes) and exchange (in same format as QNAME)
+        elif rtype == 0x000F:
+            if rdlength < 2:
+                raise MalformedResponseError(
+                    "Malformed response: truncated MX record data"
+                )
+            preference = struct.unpack_from(">H", raw_response, offset)[0]
+            exchange, _ = self.decode_domain_name(raw_response, offset + 2)
+            rdata = exchange
+        # if 0x0006, SOA (start of authority)
+        # then it has two names (primary nameserver, mailbox) and five 32-bit values
+        elif rtype == 0x0006:
+            mname, offset = self.decode_domain_name(raw_response, offset)
+            rname, offset = self.decode_domain_name(raw_response, offset)
+            if offset + 20 > next_offset:
+                raise MalformedResponseError(
+                    "Malformed response: truncated SOA record data"
                 )
-                continue
+            values = struct.unpack_from(">IIIII", raw_response, offset)
+            rdata = StartOfAuthority(mname, rname, *values)
+        else:
+            return None, next_offset
 
-            # create answer dictionary and append it to list of all answers
-            answer = dict.fromkeys(self.answer_keys)
-            answer["domain_name"] = domain_name
-            answer["rtype"] = rtype
-            answer["rclass"] = rclass
-            answer["ttl"] = ttl
-            answer["rdlength"] = rdlength
-            answer["rdata"] = rdata
-            answer["rdata_preference"] = preference
+        # records of another class than 0x0001 (Internet) are skipped
+        if rclass != 0x0001:
+            return None, next_offset
 
-            answers.append(answer)
+        answer = ResourceRecord(domain_name, rtype, rclass, ttl, rdata, preference)
+        return answer, next_offset
 
-        return answers, offset
+    def section_count(self, section):
+        return {
+            "answers": self.header.ancount,
+            "authority": self.header.nscount,
+            "additional": self.header.arcount,
+        }[section]
 
-    def decode_response(self, raw_response):
+    def section_offset(self, section):
         """
-        Build the DNS Response structure by parsing the raw response
+        Returns the offset where a section starts, skipping over (without
+        decoding) the question and the records of the previous sections
         """
+        if section not in self.section_offsets:
+            index = SECTIONS.index(section)
+            if index == 0:
+                # the question (one domain name, rtype and rclass) follows the header
+                offset = 12
+                for i in range(self.header.qdcount):
+                    offset = self.skip_domain_name(self.view, offset) + 4
+                    check_bounds(self.view, offset, "question")
+            else:
+                previous = SECTIONS[index - 1]
+                offset = self.section_offset(previous)
+                for i in range(self.section_count(previous)):
+                    offset = self.skip_domain_name(self.view, offset)
+                    check_bounds(self.view, offset + 10, "record")
+                    rdlength = struct.unpack_from(">H", self.view, offset + 8)[0]
+                    offset += 10 + rdlength
+            self.section_offsets[section] = offset
 
-        offset = 0
+        return self.section_offsets[section]
 
+    def iter_section(self, section):
         """
-        DECODE THE HEADER
-        
-        the header is contains:
-        - id: Transaction ID
-        - flags: Flags (QR, OPCODE, AA, TC, RD, RA, Z, RCODE)
-        - qdcount: Number of questions
-        - ancount: Number of answer records
-        - nscount: Number of authority records
-        - arcount: Number of additional records
+        Generator decoding the records of a section ("answers", "authority" or
+        "additional") one at a time, as they are iterated
         """
-        # unpack header
-        (
-            self.header["id"],
-            flags,
-            self.header["qdcount"],
-            self.header["ancount"],
-            self.header["nscount"],
-            self.header["arcount"],
-        ) = struct.unpack(">HHHHHH", raw_response[:12])
-        # get individual flags
-        self.header["flags"]["qr"] = flags >> 15  # QR: bit 15
-        self.header["flags"]["opcode"] = (flags >> 11) & 0b1111  # opcode: bits 11-14
-        self.header["flags"]["aa"] = (flags >> 10) & 0b1  # aa: bit 10
-        self.header["flags"]["tc"] = (flags >> 9) & 0b1  # tc: bit 9
-        self.header["flags"]["rd"] = (flags >> 8) & 0b1  # rd: bit 8
-        self.header["flags"]["ra"] = (flags >> 7) & 0b1  # ra: bit 7
-        self.header["flags"]["z"] = (flags >> 4) & 0b111  # z: bits 4-6
-        self.header["flags"]["rcode"] = flags & 0b1111  # rcode: bit 0-3
-
-        # update the offset to after the header in the raw response
-        offset = 12
-
-        """
-        DECODE THE QUESTION
+        offset = self.section_offset(section)
+        for i in range(self.section_count(section)):
+            record, offset = self.decode_record(self.view, offset)
+            if record is not None:
+                yield record
 
-        the question contains:
-        - domain: The domain name to which the response pertains
-        - rtype: The type of query (0x0001, 0x0002, or 0x000f).
-        - rclass: The class of query
+    def aged_raw_response(self, elapsed):
         """
-        # unpack question
-        self.question["domain"], offset = self.decode_domain_name(raw_response, offset)
-        self.question["rtype"], self.question["rclass"] = struct.unpack(
-            ">HH", raw_response[offset : offset + 4]
-        )
-
-        # update the offset to after the question in the raw response
-        offset += 4
+        Returns a copy of the raw response with the TTL of every record lowered
+        by elapsed seconds (down to 0), e.g. to serve it from a cache.
+        The EDNS0 OPT pseudo-record, whose TTL field holds flags, is left as is.
+        """
+        aged_response = bytearray(self.raw_response)
+        offset = self.section_offset("answers")
+        total = self.header.ancount + self.header.nscount + self.header.arcount
+        for i in range(total):
+            offset = self.skip_domain_name(self.view, offset)
+            check_bounds(self.view, offset + 10, "record")
+            rtype, _, ttl, rdlength = struct.unpack_from(">HHIH", self.view, offset)
+            if rtype != 41:
+                struct.pack_into(">I", aged_response, offset + 4, max(ttl - elapsed, 0))
+            offset += 10 + rdlength
+        return aged_response
 
+    def start_of_authority(self):
         """
-        DECODE THE ANSWERS
-        store as list of answers
+        Returns the SOA record of the authority section, None if there is none
+        """
+        for record in self.authority:
+            if record.rtype == 0x0006:
+                return record
+        return None
 
-        an answer contains:
-        - domain_name: The domain name to which the answer record pertains
-        - rtype: The type of data in the RDATA field (0x0001, 0x0002, 0x0005, or 0x000f).
-        - rclass: The class of response (expected is 0x0001, Internet class; error otherwise).
-        - ttl:
-        - rdlength:
-        - rdata:
+    @property
+    def question(self):
         """
-        self.answers, offset = self.decode_answer(
-            self.header["ancount"], raw_response, offset
-        )
+        DECODE THE QUESTION (on first access)
 
-        """SKIP AUTHORITY RECORDS"""
-        # still need to increment offset, same format as answers
-        authority, offset = self.decode_answer(
-            self.header["nscount"], raw_response, offset
-        )
+        the question contains:
+        - domain: The domain name to which the response pertains
+        - rtype: The type of query (0x0001, 0x0002, or 0x000f).
+        - rclass: The class of query
+        """
+        if self.decoded_question is None:
+            domain, offset = self.decode_domain_name(self.view, 12)
+            check_bounds(self.view, offset + 4, "question")
+            rtype, rclass = struct.unpack_from(">HH", self.view, offset)
+            self.decoded_question = Question(domain, rtype, rclass)
+        return self.decoded_question
 
+    def decode_response(self, raw_response):
         """
-        DECODE ADDITIONAL RECORDS
-        same format as answers
+        Decode the header of the DNS Response from the raw response,
+        the question and records are decoded lazily
+
+        the header is contains:
+        - id: Transaction ID
+        - flags: Flags (QR, OPCODE, AA, TC, RD, RA, Z, RCODE)
+        - qdcount: Number of questions
+        - ancount: Number of answer records
+        - nscount: Number of authority records
+        - arcount: Number of additional records
         """
-        self.additional, offset = self.decode_answer(
-            self.header["arcount"], raw_response, offset
-        )
+        # unpack header and its individual flags
+        check_bounds(raw_response, 12, "header")
+        self.header = Header(*struct.unpack_from(">HHHHHH", raw_response))
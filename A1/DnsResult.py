@@ -0,0 +1,118 @@
+import DnsAsyncResolver as async_resolver
+import DnsIterative as iterative
+import DnsLookup as lookup
+import DnsResponse as response
+import DnsRtt as rtt
+
+# name of each record type decoded
+RTYPE_NAMES = {0x0001: "A", 0x0002: "NS", 0x0005: "CNAME", 0x0006: "SOA", 0x000F: "MX"}
+
+
+def response_error(dns_response, recursive=True):
+    """
+    Returns the error message for a response with an error, None otherwise.
+    NOTFOUND (RCODE 3) is not treated as an error. Responses of authoritative
+    servers queried iteratively (recursive=False) need not set the RA flag.
+    """
+    # the QR, RA and RCODE flags are checked as by DnsLookup
+    error = lookup.response_error(None, dns_response, recursive)
+    if error is None or isinstance(error, lookup.NameNotFoundError):
+        return None
+    if isinstance(error, lookup.UnexpectedResponseError):
+        return f"Unexpected response: {error}"
+    return str(error)
+
+
+def record_result(record):
+    # record as a JSON object
+    result = {
+        "name": record.domain_name,
+        "type": RTYPE_NAMES.get(record.rtype, record.rtype),
+        "ttl": record.ttl,
+        "data": record.rdata_text(),
+    }
+    if record.rtype == 0x000F:
+        result["preference"] = record.preference
+    return result
+
+
+def query_result(
+    name, qtype, server, latency, attempts, dns_response, args, error=None
+):
+    """
+    Returns the result of a query as a JSON object: the question, the server
+    that answered, the latency, the number of attempts and, if a response was
+    received, its rcode and records
+    """
+    result = {
+        "name": name,
+        "qtype": RTYPE_NAMES.get(qtype, qtype),
+        "server": server,
+        "latency_ms": round(latency * 1000, 3),
+        "attempts": attempts,  # None if unknown
+    }
+    if dns_response is None:
+        result["status"] = "ERROR"
+        result["error"] = str(error)
+        return result
+
+    result["rcode"] = dns_response.header.rcode
+    result["authoritative"] = bool(dns_response.header.aa)
+    result["size"] = len(dns_response.raw_response)
+    error_message = response_error(dns_response, not args.iterative)
+    try:
+        result["answers"] = [record_result(r) for r in dns_response.answers]
+        result["authority"] = [
+            record_result(r) for r in dns_response.authority if r.rtype == 0x0006
+        ]
+        result["additional"] = [record_result(r) for r in dns_response.additional]
+    except response.MalformedResponseError as error:
+        error_message = str(error)
+
+    if error_message is not None:
+        result["status"] = "ERROR"
+        result["error"] = error_message
+    elif dns_response.header.rcode == 3:
+        result["status"] = "NOTFOUND"
+    else:
+        result["status"] = "OK"
+    return result
+
+
+def failed_attempts(args, error):
+    # every attempt was sent before a timeout, unknown for other errors
+    return args.retries if isinstance(error, TimeoutError) else None
+
+
+def failed_retries(args, error):
+    # retries recorded for a failure: every one for a timeout, none for other
+    # errors (a malformed response or a refused connection ends the attempt)
+    return args.retries - 1 if isinstance(error, TimeoutError) else 0
+
+
+def new_resolver(args, dns_cache=None, max_in_flight=1000):
+    """
+    Creates the asyncio resolver of the arguments: iterative from the root
+    servers (or from the given servers) with -i, else racing across the servers
+    """
+    if args.iterative:
+        return iterative.IterativeResolver(
+            args.servers or iterative.ROOT_HINTS,
+            args.port,
+            args.timeout,
+            args.retries,
+            max_in_flight,
+            dns_cache,
+            rtt.RttTable(),
+            args.edns,
+        )
+    return async_resolver.RacingResolver(
+        args.servers,
+        args.port,
+        args.timeout,
+        args.retries,
+        max_in_flight,
+        dns_cache,
+        rtt.RttTable(),
+        args.edns,
+    )
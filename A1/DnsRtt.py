@@ -0,0 +1,84 @@
+import random
+
+# smoothing gains of the RTT estimators (same as TCP, RFC 6298)
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+
+# timeout of a server without any RTT sample yet, and lower bound of all timeouts
+INITIAL_TIMEOUT = 1.0
+MIN_TIMEOUT = 0.05
+
+# retransmission timeouts are spread by up to this fraction
+JITTER = 0.25
+
+# a server's score is doubled for each recent failure, up to this many
+MAX_FAILURE_PENALTY = 6
+
+
+class RttEstimator:
+    def __init__(self):
+        """
+        Initializes the RTT estimates of a single server with:
+        - srtt: Smoothed round-trip time, in seconds (None until the first sample)
+        - rttvar: Round-trip time variance, in seconds
+        - failures: Number of queries that failed since the last RTT sample
+        """
+        self.srtt = None
+        self.rttvar = None
+        self.failures = 0
+
+    def update(self, rtt):
+        """
+        Adds a round-trip time sample. Only responses to queries sent once should
+        be sampled, a response to a retransmission is ambiguous (Karn's algorithm).
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        self.failures = 0
+
+    def failed(self):
+        # the server did not answer a query (or answered with a server error)
+        self.failures += 1
+
+    def score(self):
+        """
+        Returns the health score of the server, the expected response time
+        penalized by its recent failures (lower is better)
+        """
+        expected = INITIAL_TIMEOUT if self.srtt is None else self.srtt
+        return expected * 2 ** min(self.failures, MAX_FAILURE_PENALTY)
+
+    def timeout(self, attempt, max_timeout):
+        """
+        Returns the timeout of the given attempt (0 for the first transmission):
+        SRTT + 4 * RTTVAR, doubled for every previous attempt, randomly
+        spread by JITTER and capped by max_timeout
+        """
+        if self.srtt is None:
+            rto = INITIAL_TIMEOUT
+        else:
+            rto = self.srtt + 4 * self.rttvar
+
+        rto *= 2**attempt
+        rto *= 1 + random.uniform(0, JITTER)
+        return min(max(rto, MIN_TIMEOUT), max_timeout)
+
+
+class RttTable:
+    def __init__(self):
+        """
+        Initializes the RTT estimates of every server, keyed by (server, port)
+        """
+        self.estimators = {}
+
+    def get(self, dns_server, port):
+        key = (dns_server, port)
+        estimator = self.estimators.get(key)
+        if estimator is None:
+            # setdefault is atomic, so threads sharing the table share one estimator
+            estimator = self.estimators.setdefault(key, RttEstimator())
+        return estimator
@@ -0,0 +1,387 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import zlib
+import DnsCache as cache
+import DnsResult as dns_result
+
+# questions sent to a worker at once, and batches queued per worker
+BATCH_SIZE = 256
+QUEUED_BATCHES = 4
+
+# results a worker sends at once, and the longest it holds them while idle
+RESULT_BATCH_SIZE = 256
+RESULT_FLUSH_DELAY = 0.1
+
+# batches of results queued for the writer, per worker
+QUEUED_RESULTS = 4
+
+
+def shard_of(name, workers):
+    """
+    Returns the worker resolving a name, so every repeat of the name
+    is answered from the same cache shard
+    """
+    return zlib.crc32(name.lower().rstrip(".").encode("utf-8")) % workers
+
+
+class Checkpoint:
+    def __init__(self, path, input_path, output_path, ordered):
+        """
+        Initializes the checkpoint of a bulk job, saved atomically to path, with:
+        - watermark: Index of the first question whose result is not written,
+          the results of every earlier question being written
+        - written: Indexes above the watermark whose result is written
+          (out of order, unordered output only)
+        - output_offset: Size of the output once those results were written,
+          the output is truncated back to it on resume
+        - counts: Questions resolved, failed and answered from a cache
+        - complete: Whether every question was resolved
+        """
+        self.path = path
+        self.input_path = input_path
+        self.output_path = output_path
+        self.ordered = ordered
+        self.watermark = 0
+        self.written = []
+        self.output_offset = 0
+        self.counts = {"done": 0, "failed": 0, "cache_hits": 0}
+        self.complete = False
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the checkpoint saved at path, None if there is none
+        """
+        try:
+            with open(path) as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return None
+        checkpoint = cls(path, state["input"], state["output"], state["ordered"])
+        checkpoint.watermark = state["watermark"]
+        checkpoint.written = state["written"]
+        checkpoint.output_offset = state["output_offset"]
+        checkpoint.counts = state["counts"]
+        checkpoint.complete = state["complete"]
+        return checkpoint
+
+    def save(self):
+        # written next to the checkpoint then renamed over it, so a crash
+        # leaves either the previous checkpoint or the new one
+        state = {
+            "input": self.input_path,
+            "output": self.output_path,
+            "ordered": self.ordered,
+            "watermark": self.watermark,
+            "written": self.written,
+            "output_offset": self.output_offset,
+            "counts": self.counts,
+            "complete": self.complete,
+        }
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.path)
+
+
+async def resolve_question(args, resolver, name, qtype):
+    """
+    Resolves a question iteratively (-i) or by racing it across the servers.
+    Returns its result as a JSON object (see DnsResult.query_result), an
+    ERROR result for a malformed response rather than raising, as the
+    worker would exit and the question be handed to it again on resume.
+    """
+    start_time = time.perf_counter()
+    server = None
+    try:
+        if args.iterative:
+            dns_response, retries = await resolver.query(name, qtype)
+        else:
+            dns_response, retries, server = await resolver.race(name, qtype)
+            if server is None:
+                server = "cache"
+        latency = time.perf_counter() - start_time
+    except (OSError, ValueError) as error:  # e.g. malformed, too many referrals
+        latency = time.perf_counter() - start_time
+        attempts = dns_result.failed_attempts(args, error)
+        return dns_result.query_result(
+            name, qtype, server, latency, attempts, None, args, error
+        )
+
+    attempts = 0 if server == "cache" else retries + 1
+    return dns_result.query_result(
+        name, qtype, server, latency, attempts, dns_response, args
+    )
+
+
+async def resolve_shard(shard, args, tasks, results):
+    """
+    Resolves the batches of questions of a worker over its own multiplexed
+    socket and cache shard, at most args.window at once, sending their
+    results in batches until it receives None
+    """
+    loop = asyncio.get_running_loop()
+    window = asyncio.Semaphore(args.window)
+    outgoing = []  # (index, result) not sent yet
+    running = set()
+
+    async def flush():
+        if not outgoing:
+            return
+        batch = outgoing[:]
+        outgoing.clear()
+        # blocks while the writer lags behind (the results queue is full)
+        await loop.run_in_executor(None, results.put, (shard, batch))
+
+    async def resolve(resolver, index, name, qtype):
+        try:
+            result = await resolve_question(args, resolver, name, qtype)
+            outgoing.append((index, result))
+        finally:
+            window.release()
+
+    async with dns_result.new_resolver(args, cache.DnsCache(), args.window) as resolver:
+        while True:
+            try:
+                batch = await loop.run_in_executor(
+                    None, tasks.get, True, RESULT_FLUSH_DELAY
+                )
+            except queue.Empty:
+                await flush()  # idle, send what is resolved so far
+                continue
+            if batch is None:
+                break
+
+            for index, name, qtype in batch:
+                await window.acquire()
+                task = asyncio.ensure_future(resolve(resolver, index, name, qtype))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                if len(outgoing) >= RESULT_BATCH_SIZE:
+                    await flush()
+
+        await asyncio.gather(*list(running))
+        await flush()
+
+    results.put((shard, None))  # the worker is done
+
+
+def run_worker(shard, args, tasks, results):
+    """
+    Entry point of a worker process
+    """
+    # interrupts are handled by the parent, which saves the checkpoint
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(resolve_shard(shard, args, tasks, results))
+
+
+class ShardedBulkResolver:
+    def __init__(self, args, workers, ordered=True, interval=5):
+        """
+        Initializes a bulk resolver spreading the questions across worker
+        processes (each with its own socket and cache shard) with:
+        - args: Arguments of the resolvers, those of dnsClient (servers, port,
+          timeout, retries, edns, window and iterative)
+        - workers: Number of worker processes
+        - ordered: Whether results are written in the order of the questions,
+          else as soon as they complete
+        - interval: Seconds between progress reports and checkpoints
+        - max_ahead: Maximum number of questions handed out beyond the first
+          one whose result is not written, bounding the results held in memory
+        """
+        self.args = args
+        self.workers = workers
+        self.ordered = ordered
+        self.interval = interval
+        self.max_ahead = workers * 4 * (BATCH_SIZE * QUEUED_BATCHES + args.window)
+
+        # progress of the output, shared with the feeder thread
+        self.condition = threading.Condition()
+        self.watermark = 0  # first question whose result is not written
+        self.written = set()  # written indexes above the watermark
+        self.pending = {}  # results waiting for an earlier one (ordered output)
+        self.stopping = False
+        self.feed_error = None
+
+        self.counts = {"done": 0, "failed": 0, "cache_hits": 0}
+
+    def feed(self, questions, tasks):
+        """
+        Hands the questions not written yet out to the workers, by batch,
+        blocking while their queues are full or too far ahead of the output
+        """
+        batches = [[] for _ in range(self.workers)]
+
+        def send(shard):
+            if batches[shard]:
+                tasks[shard].put(batches[shard])
+                batches[shard] = []
+
+        try:
+            for index, (name, qtype) in enumerate(questions):
+                with self.condition:
+                    if index < self.watermark or index in self.written:
+                        continue  # written before the checkpoint
+                    if index - self.watermark >= self.max_ahead:
+                        # partial batches may hold the question the output waits for
+                        for shard in range(self.workers):
+                            send(shard)
+                        while index - self.watermark >= self.max_ahead:
+                            if self.stopping:
+                                return
+                            self.condition.wait(1)
+
+                shard = shard_of(name, self.workers)
+                batches[shard].append((index, name, qtype))
+                if len(batches[shard]) >= BATCH_SIZE:
+                    send(shard)
+        except Exception as error:  # e.g. the input cannot be read
+            self.feed_error = error
+        finally:
+            for shard in range(self.workers):
+                if not self.stopping:
+                    send(shard)
+                tasks[shard].put(None)
+
+    def write_line(self, output, line, result):
+        # counts only what reaches the output, so checkpointed counts match it
+        output.write(line)
+        self.counts["done"] += 1
+        if result["status"] == "ERROR":
+            self.counts["failed"] += 1
+        if result["server"] == "cache":
+            self.counts["cache_hits"] += 1
+
+    def write(self, output, index, result):
+        """
+        Writes a result, or holds it until every earlier one is written
+        """
+        line = (json.dumps(result) + "\n").encode("utf-8")
+        with self.condition:
+            if self.ordered:
+                self.pending[index] = (line, result)
+            else:
+                self.write_line(output, line, result)
+                self.written.add(index)
+
+            # move the watermark past every result written
+            while True:
+                if self.watermark in self.pending:
+                    self.write_line(output, *self.pending.pop(self.watermark))
+                elif self.watermark in self.written:
+                    self.written.discard(self.watermark)
+                else:
+                    break
+                self.watermark += 1
+            self.condition.notify_all()
+
+    def save(self, checkpoint, output, complete=False):
+        # the output is on disk before the checkpoint pointing past it
+        output.flush()
+        os.fsync(output.fileno())
+        with self.condition:
+            checkpoint.watermark = self.watermark
+            checkpoint.written = sorted(self.written)
+        checkpoint.output_offset = output.tell()
+        checkpoint.counts = dict(self.counts)
+        checkpoint.complete = complete
+        checkpoint.save()
+
+    def report(self, start_time, start_done):
+        elapsed = time.perf_counter() - start_time
+        resolved = self.counts["done"] - start_done
+        qps = resolved / elapsed if elapsed > 0 else 0.0
+        print(
+            f"{self.counts['done']} names, {qps:.1f} QPS, "
+            f"{self.counts['failed']} failed, {self.counts['cache_hits']} cache hits",
+            file=sys.stderr,
+        )
+
+    def run(self, questions, output, checkpoint=None):
+        """
+        Resolves the (name, qtype) questions, writing one JSON result per line
+        to the binary output. With a checkpoint, resumes after the questions
+        it records as written (the output being truncated to its offset) and
+        saves it every interval seconds. Returns the counts and elapsed time.
+        """
+        if checkpoint is not None:
+            self.watermark = checkpoint.watermark
+            self.written = set(checkpoint.written)
+            self.counts = dict(checkpoint.counts)
+            output.truncate(checkpoint.output_offset)
+            output.seek(checkpoint.output_offset)
+        start_done = self.counts["done"]
+
+        tasks = [multiprocessing.Queue(QUEUED_BATCHES) for _ in range(self.workers)]
+        results = multiprocessing.Queue(QUEUED_RESULTS * self.workers)
+        # batches left in the queues of stopped workers do not block the exit
+        for task_queue in tasks:
+            task_queue.cancel_join_thread()
+        processes = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(shard, self.args, tasks[shard], results),
+                daemon=True,
+            )
+            for shard in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+        feeder = threading.Thread(
+            target=self.feed, args=(questions, tasks), daemon=True
+        )
+
+        start_time = time.perf_counter()
+        last_report = start_time
+        finished = set()
+        complete = False
+        try:
+            feeder.start()
+            while len(finished) < self.workers:
+                try:
+                    shard, batch = results.get(timeout=min(self.interval, 1))
+                except queue.Empty:
+                    shard, batch = None, []
+                    for dead, process in enumerate(processes):
+                        if dead not in finished and not process.is_alive():
+                            raise RuntimeError(f"Worker {dead} exited unexpectedly")
+
+                if batch is None:
+                    finished.add(shard)
+                for index, result in batch or []:
+                    self.write(output, index, result)
+
+                now = time.perf_counter()
+                if now - last_report >= self.interval:
+                    last_report = now
+                    self.report(start_time, start_done)
+                    if checkpoint is not None:
+                        self.save(checkpoint, output)
+
+            feeder.join()
+            if self.feed_error is not None:
+                raise self.feed_error
+            complete = True
+        finally:
+            with self.condition:
+                self.stopping = True
+                self.condition.notify_all()
+            for process in processes:
+                process.terminate()
+            # what was written so far is kept, to resume from
+            if checkpoint is not None:
+                self.save(checkpoint, output, complete)
+            output.flush()
+
+        elapsed = time.perf_counter() - start_time
+        self.report(start_time, start_done)
+        return dict(self.counts), elapsed
@@ -0,0 +1,248 @@
+import random
+import socket
+import struct
+import threading
+import time
+
+
+def new_udp_socket(dns_server, port):
+    """
+    Creates a UDP socket connected to the DNS server, bound to a random
+    ephemeral source port chosen by the kernel. Being connected, it only
+    receives datagrams sent from the server's address and port.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect((dns_server, port))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def receive_response(sock, transaction_id, timeout, buffer_size=512):
+    """
+    Waits up to timeout seconds for the response with the given transaction ID.
+    Late responses to earlier queries sent from the same socket are discarded.
+    Raises socket.timeout if no matching response arrives in time.
+    """
+    expected_id = struct.pack(">H", transaction_id)
+    deadline = time.monotonic() + timeout
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout("timed out")
+        sock.settimeout(remaining)
+
+        response = sock.recv(buffer_size)
+        if response[:2] == expected_id:
+            return response
+
+
+def is_truncated(response):
+    # TC flag is bit 9 of the flags, i.e. bit 1 of the header's third byte
+    return len(response) >= 4 and response[2] & 0x02 != 0
+
+
+def new_tcp_connection(dns_server, port, timeout):
+    return socket.create_connection((dns_server, port), timeout)
+
+
+def receive_exactly(sock, length):
+    """
+    Reads exactly length bytes from a TCP socket
+    """
+    data = bytearray()
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise ConnectionResetError("Connection closed by the DNS server")
+        data += chunk
+    return bytes(data)
+
+
+def tcp_exchange(sock, query_packet, transaction_id, timeout):
+    """
+    Sends a query over a TCP connection and returns the response with the given
+    transaction ID. Over TCP, every message is prefixed by its 2-byte length.
+    """
+    sock.settimeout(timeout)
+    sock.sendall(struct.pack(">H", len(query_packet)) + query_packet)
+
+    expected_id = struct.pack(">H", transaction_id)
+    while True:
+        length = struct.unpack(">H", receive_exactly(sock, 2))[0]
+        response = receive_exactly(sock, length)
+        if response[:2] == expected_id:
+            return response
+
+
+def tcp_query(dns_server, port, query_packet, transaction_id, timeout):
+    """
+    Sends a query over a new TCP connection, closed once the response is received
+    """
+    with new_tcp_connection(dns_server, port, timeout) as sock:
+        return tcp_exchange(sock, query_packet, transaction_id, timeout)
+
+
+class TcpConnectionPool:
+    def __init__(self, max_idle_per_server=4):
+        """
+        Initializes a pool of kept-alive TCP connections with:
+        - max_idle_per_server: Maximum number of idle connections kept per (server, port)
+        - idle: Maps each (server, port) to its idle connections
+        """
+        self.max_idle_per_server = max_idle_per_server
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def exchange(self, dns_server, port, query_packet, transaction_id, timeout):
+        """
+        Sends a query over an idle connection to the server if there is one,
+        otherwise (or if the server closed the idle connection) over a new one,
+        and keeps the connection alive for the next queries
+        """
+        with self.lock:
+            if self.closed:
+                raise ValueError("Connection pool is closed")
+            idle = self.idle.get((dns_server, port))
+            sock = idle.pop() if idle else None
+
+        if sock is not None:
+            try:
+                response = tcp_exchange(sock, query_packet, transaction_id, timeout)
+                self.release(dns_server, port, sock)
+                return response
+            except ConnectionError:
+                sock.close()  # idle connection closed by the server, use a new one
+            except OSError:
+                sock.close()
+                raise
+
+        sock = new_tcp_connection(dns_server, port, timeout)
+        try:
+            response = tcp_exchange(sock, query_packet, transaction_id, timeout)
+        except OSError:
+            sock.close()
+            raise
+        self.release(dns_server, port, sock)
+        return response
+
+    def release(self, dns_server, port, sock):
+        with self.lock:
+            idle = self.idle.setdefault((dns_server, port), [])
+            if not self.closed and len(idle) < self.max_idle_per_server:
+                idle.append(sock)
+                return
+
+        sock.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle_sockets = [sock for idle in self.idle.values() for sock in idle]
+            self.idle.clear()
+
+        for sock in idle_sockets:
+            sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class UdpSocketPool:
+    def __init__(self, max_idle_per_server=16, ports_per_server=8, max_uses=100):
+        """
+        Initializes a pool of long-lived UDP sockets with:
+        - max_idle_per_server: Maximum number of idle sockets kept per (server, port),
+          sockets released above it are closed
+        - ports_per_server: Number of sockets, each bound to its own random
+          ephemeral source port, opened per (server, port) before idle ones
+          are reused, so even sequential queries spread over that many ports
+        - max_uses: Number of queries after which a socket is closed and
+          replaced by one on a new source port
+        - idle: Maps each (server, port) to its idle connected sockets
+        - opened: Number of sockets open per (server, port), idle or in use
+        - uses: Number of queries sent from each open pooled socket
+        """
+        self.max_idle_per_server = max_idle_per_server
+        self.ports_per_server = ports_per_server
+        self.max_uses = max_uses
+        self.idle = {}
+        self.opened = {}
+        self.uses = {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def acquire(self, dns_server, port):
+        """
+        Returns a socket connected to the server: a new one (on a new random
+        source port) until ports_per_server are open, then one of the idle
+        sockets picked at random, so consecutive queries use random source ports
+        """
+        key = (dns_server, port)
+        with self.lock:
+            if self.closed:
+                raise ValueError("Socket pool is closed")
+            idle = self.idle.get(key)
+            if idle and self.opened[key] >= self.ports_per_server:
+                sock = idle.pop(random.randrange(len(idle)))
+                self.uses[sock] += 1
+                return sock
+            self.opened[key] = self.opened.get(key, 0) + 1
+
+        try:
+            sock = new_udp_socket(dns_server, port)
+        except OSError:
+            with self.lock:
+                self.opened[key] -= 1
+            raise
+        with self.lock:
+            self.uses[sock] = 1
+        return sock
+
+    def release(self, dns_server, port, sock):
+        """
+        Returns a socket acquired for the server to the pool, closing it
+        once it has sent max_uses queries
+        """
+        key = (dns_server, port)
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if (
+                not self.closed
+                and len(idle) < self.max_idle_per_server
+                and self.uses.get(sock, self.max_uses) < self.max_uses
+            ):
+                idle.append(sock)
+                return
+            self.uses.pop(sock, None)
+            if key in self.opened:
+                self.opened[key] -= 1
+
+        sock.close()
+
+    def close(self):
+        """
+        Closes every idle socket, sockets still in use are closed on release
+        """
+        with self.lock:
+            self.closed = True
+            idle_sockets = [sock for idle in self.idle.values() for sock in idle]
+            self.idle.clear()
+            self.opened.clear()
+            self.uses.clear()
+
+        for sock in idle_sockets:
+            sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,329 @@
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import multiprocessing
+import sys
+import threading
+import time
+import DnsAsyncResolver as async_resolver
+import DnsMockServer as mock_server
+import DnsQuery as query
+import DnsRtt as rtt
+import DnsTransport as transport
+import dnsClient as client
+
+# ways of sending the queries that can be compared
+MODES = ["blocking", "pooled", "async"]
+
+
+def init_args():
+
+    # error handling: ensure correct syntax for the numeric arguments
+    def ensure_non_negative(value, argument, kind=float):
+        try:
+            value = kind(value)
+            if value < 0:
+                raise argparse.ArgumentTypeError(
+                    f"Argument {argument} must be positive"
+                )
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Argument {argument} must be a number")
+        return value
+
+    # error handling: ensure at least one query, worker, attempt and a non-zero timeout
+    def ensure_positive(value, argument, kind=int):
+        try:
+            value = kind(value)
+            if value <= 0:
+                raise argparse.ArgumentTypeError(
+                    f"Argument {argument} must be strictly positive"
+                )
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Argument {argument} must be a number")
+        return value
+
+    """parse the command line arguments (stdin)"""
+    parser = client.CustomArgumentParser(allow_abbrev=False)
+
+    # load generator
+    parser.add_argument("-m", choices=MODES + ["all"], default="all", dest="mode")
+    parser.add_argument(
+        "-n",
+        type=lambda val: ensure_positive(val, "queries"),
+        default=2000,
+        dest="queries",
+    )
+    parser.add_argument(
+        "-w",
+        type=lambda val: ensure_positive(val, "concurrency"),
+        default=50,
+        dest="concurrency",
+    )
+    parser.add_argument(
+        "-q",
+        type=lambda val: ensure_non_negative(val, "QPS"),
+        default=0,
+        dest="qps",
+    )
+    parser.add_argument(
+        "-t",
+        type=lambda val: ensure_positive(val, "timeout", float),
+        default=1.0,
+        dest="timeout",
+    )
+    parser.add_argument(
+        "-r",
+        type=lambda val: ensure_positive(val, "retries"),
+        default=3,
+        dest="retries",
+    )
+    parser.add_argument("-e", type=int, default=None, dest="edns")
+
+    # mock server
+    parser.add_argument(
+        "-l",
+        type=lambda val: ensure_non_negative(val, "latency"),
+        default=1.0,
+        dest="latency",
+    )
+    parser.add_argument(
+        "-d",
+        type=lambda val: ensure_non_negative(val, "loss"),
+        default=0.0,
+        dest="loss",
+    )
+    parser.add_argument(
+        "-T",
+        type=lambda val: ensure_non_negative(val, "truncation"),
+        default=0.0,
+        dest="truncation",
+    )
+    parser.add_argument(
+        "-a",
+        type=lambda val: ensure_non_negative(val, "answers", int),
+        default=1,
+        dest="answers",
+    )
+
+    return parser.parse_args()
+
+
+class LoadStatistics:
+    def __init__(self):
+        """
+        Initializes the statistics of a load run with:
+        - latencies: Latency of each answered query, in seconds
+        - retries: Number of retransmissions, over all queries
+        - timeouts: Number of queries left unanswered after every retry
+        """
+        self.latencies = []
+        self.retries = 0
+        self.timeouts = 0
+        self.lock = threading.Lock()
+
+    def answered(self, latency, retries):
+        with self.lock:
+            self.latencies.append(latency)
+            self.retries += retries
+
+    def timed_out(self, retries):
+        with self.lock:
+            self.timeouts += 1
+            self.retries += retries
+
+
+def bench_name(index):
+    # distinct names, so no query is answered by a cache or coalesced
+    return f"host{index}.bench.test"
+
+
+def send_time(args, start_time, index):
+    # time the query is due at the target QPS (right away without a target)
+    return start_time + index / args.qps if args.qps > 0 else start_time
+
+
+def run_blocking(args, port, pooled):
+    """
+    Sends the queries with DnsQuery.send from args.concurrency threads, with a
+    new socket per query or (pooled) long-lived sockets and TCP connections
+    """
+    statistics = LoadStatistics()
+    indexes = itertools.count()
+    index_lock = threading.Lock()
+    rtt_table = rtt.RttTable()
+    udp_pool = transport.UdpSocketPool() if pooled else None
+    tcp_pool = transport.TcpConnectionPool() if pooled else None
+    start_time = time.perf_counter()
+
+    def worker():
+        while True:
+            with index_lock:
+                index = next(indexes)
+            if index >= args.queries:
+                return
+
+            delay = send_time(args, start_time, index) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            dns_query = query.DnsQuery(bench_name(index), 0x0001, 0x0001, args.edns)
+            query_start = time.perf_counter()
+            raw_response, retries = dns_query.send(
+                "127.0.0.1",
+                port,
+                args.timeout,
+                args.retries,
+                udp_pool,
+                rtt_table,
+                tcp_pool,
+            )
+            if raw_response is None:
+                statistics.timed_out(args.retries - 1)
+            else:
+                statistics.answered(
+                    time.perf_counter() - query_start, args.retries - retries - 1
+                )
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if pooled:
+        udp_pool.close()
+        tcp_pool.close()
+    return statistics
+
+
+async def run_async(args, port):
+    """
+    Sends the queries with an AsyncDnsResolver from args.concurrency coroutines
+    sharing one UDP socket
+    """
+    statistics = LoadStatistics()
+    indexes = itertools.count()
+    start_time = time.perf_counter()
+
+    async with async_resolver.AsyncDnsResolver(
+        "127.0.0.1",
+        port,
+        args.timeout,
+        args.retries,
+        args.concurrency,
+        None,
+        rtt.RttTable(),
+        args.edns,
+    ) as resolver:
+
+        async def worker():
+            for index in indexes:
+                if index >= args.queries:
+                    return
+
+                delay = send_time(args, start_time, index) - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                query_start = time.perf_counter()
+                try:
+                    _, retries = await resolver.query(bench_name(index), 0x0001)
+                except (OSError, ValueError):
+                    statistics.timed_out(args.retries - 1)
+                    continue
+                statistics.answered(time.perf_counter() - query_start, retries)
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+    return statistics
+
+
+def run_mode(args, mode, port):
+    """
+    Runs the load of one mode, returns its results as a dict
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    if mode == "async":
+        statistics = asyncio.run(run_async(args, port))
+    else:
+        statistics = run_blocking(args, port, pooled=mode == "pooled")
+    cpu = time.process_time() - cpu_start
+    elapsed = time.perf_counter() - wall_start
+
+    latencies = sorted(statistics.latencies)
+    return {
+        "mode": mode,
+        "queries": args.queries,
+        "answered": len(latencies),
+        "timeouts": statistics.timeouts,
+        "retries": statistics.retries,
+        "elapsed_s": round(elapsed, 6),
+        "throughput_qps": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "mean": (
+                round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0
+            ),
+            "p50": round(client.percentile(latencies, 50) * 1000, 3),
+            "p95": round(client.percentile(latencies, 95) * 1000, 3),
+            "p99": round(client.percentile(latencies, 99) * 1000, 3),
+        },
+        "cpu_us_per_query": (
+            round(cpu / args.queries * 1e6, 1) if args.queries else 0.0
+        ),
+    }
+
+
+def main():
+    """
+    Starts the mock server in its own process, so its CPU time is not counted,
+    runs the load of each mode against it and prints the results as JSON
+    """
+    args = init_args()
+    modes = MODES if args.mode == "all" else [args.mode]
+
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=mock_server.run,
+        args=(ready,),
+        kwargs={
+            "latency": args.latency / 1000,
+            "loss": args.loss,
+            "truncation": args.truncation,
+            "answers": args.answers,
+        },
+        daemon=True,
+    )
+    server.start()
+    try:
+        port = ready.get(timeout=10)
+
+        # errors printed by the blocking client go to stderr, not in the JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            results = [run_mode(args, mode, port) for mode in modes]
+    finally:
+        server.terminate()
+        server.join()
+
+    config = {
+        key: getattr(args, key)
+        for key in [
+            "queries",
+            "concurrency",
+            "qps",
+            "timeout",
+            "retries",
+            "edns",
+            "latency",
+            "loss",
+            "truncation",
+            "answers",
+        ]
+    }
+    print(json.dumps({"config": config, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
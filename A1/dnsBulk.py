@@ -0,0 +1,161 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import DnsShardedBulk as sharded_bulk
+import dnsClient as client
+
+
+def init_args():
+
+    # error handling: ensure correct syntax for the integer arguments (positive int)
+    def ensure_positive(value, argument):
+        try:
+            value = int(value)
+            if value <= 0:
+                raise argparse.ArgumentTypeError(
+                    f"Argument {argument} must be strictly positive"
+                )
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Argument {argument} must be an integer")
+        return value
+
+    """parse the command line arguments (stdin)"""
+    parser = client.CustomArgumentParser(allow_abbrev=False)
+
+    # resolvers, as for the client
+    parser.add_argument(
+        "-t",
+        type=lambda val: ensure_positive(val, "timeout"),
+        default=5,
+        dest="timeout",
+    )
+    parser.add_argument(
+        "-r",
+        type=lambda val: ensure_positive(val, "retries"),
+        default=3,
+        dest="retries",
+    )
+    parser.add_argument("-p", type=int, default=53, dest="port")
+    parser.add_argument(
+        "-e",
+        type=lambda val: ensure_positive(val, "EDNS payload size"),
+        default=None,
+        dest="edns",
+    )
+    parser.add_argument(
+        "-w",
+        type=lambda val: ensure_positive(val, "window"),
+        default=100,
+        dest="window",
+    )
+    parser.add_argument("-i", action="store_true", default=False, dest="iterative")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("-mx", action="store_true", default=False)
+    group.add_argument("-ns", action="store_true", default=False)
+
+    # job
+    parser.add_argument("-f", type=str, required=True, dest="file")
+    parser.add_argument(
+        "-j",
+        type=lambda val: ensure_positive(val, "workers"),
+        default=os.cpu_count() or 1,
+        dest="workers",
+    )
+    parser.add_argument("-O", type=str, default="-", dest="output_file")
+    parser.add_argument("-C", type=str, default=None, dest="checkpoint")
+    parser.add_argument("-u", action="store_true", default=False, dest="unordered")
+    parser.add_argument(
+        "-s",
+        type=lambda val: ensure_positive(val, "progress interval"),
+        default=5,
+        dest="interval",
+    )
+
+    # positional arguments: the servers (optional with -i)
+    parser.add_argument("servers", type=str, nargs="*")
+
+    args = parser.parse_args()
+
+    # error handling: ensure correct syntax for the servers (start with @)
+    if not all(server.startswith("@") for server in args.servers):
+        parser.error("Argument server must start with @")
+    args.servers = [server[1:] for server in args.servers]  # truncate the @
+    if not args.servers and not args.iterative:
+        parser.error("Argument server must start with @")
+
+    # error handling: a checkpoint needs files to resume from
+    if args.checkpoint is not None and "-" in (args.file, args.output_file):
+        parser.error("Argument -C needs an input file (-f) and an output file (-O)")
+
+    return args
+
+
+def open_output(args, checkpoint):
+    # the output of a resumed job is kept up to its checkpoint
+    if args.output_file == "-":
+        return os.fdopen(sys.stdout.fileno(), "wb", closefd=False)
+    if checkpoint is not None and checkpoint.output_offset > 0:
+        return open(args.output_file, "r+b")
+    return open(args.output_file, "wb")
+
+
+def main():
+    """
+    Resolves the names of a file across worker processes, writing one JSON
+    result per line, and resumes from the checkpoint (-C) if there is one
+    """
+    args = init_args()
+    default_qtype = client.QTYPES["MX" if args.mx else "NS" if args.ns else "A"]
+
+    checkpoint = None
+    if args.checkpoint is not None:
+        checkpoint = sharded_bulk.Checkpoint.load(args.checkpoint)
+        job = (
+            os.path.abspath(args.file),
+            os.path.abspath(args.output_file),
+            not args.unordered,
+        )
+        if checkpoint is None:
+            checkpoint = sharded_bulk.Checkpoint(args.checkpoint, *job)
+        elif job != (
+            checkpoint.input_path,
+            checkpoint.output_path,
+            checkpoint.ordered,
+        ):
+            client.print_error(f"Checkpoint {args.checkpoint} is of another job")
+            return
+        elif checkpoint.complete:
+            print(f"Checkpoint {args.checkpoint} is of a complete job", file=sys.stderr)
+            return
+        elif checkpoint.watermark > 0 or checkpoint.written:
+            print(f"Resuming after {checkpoint.counts['done']} names", file=sys.stderr)
+
+    resolver = sharded_bulk.ShardedBulkResolver(
+        args, args.workers, not args.unordered, args.interval
+    )
+    input_file = sys.stdin if args.file == "-" else open(args.file)
+    output = open_output(args, checkpoint)
+    try:
+        # errors printed on unsupported lines go to stderr, not in the results
+        with contextlib.redirect_stdout(sys.stderr):
+            questions = client.read_bulk_questions(input_file, default_qtype)
+            counts, elapsed = resolver.run(questions, output, checkpoint)
+    except KeyboardInterrupt:
+        print("Interrupted, resume with the same command", file=sys.stderr)
+        return
+    except (OSError, RuntimeError) as error:
+        client.print_error(error)
+        return
+    finally:
+        output.close()
+        if input_file is not sys.stdin:
+            input_file.close()
+
+    summary = dict(counts, elapsed_s=round(elapsed, 6), workers=args.workers)
+    print(json.dumps({"summary": summary}), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
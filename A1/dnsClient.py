@@ -1,8 +1,22 @@
 import argparse
+import asyncio
+import json
 import time
 import sys
+import DnsCache as cache
+import DnsCacheFile as cache_file
+import DnsFanout as fanout
+import DnsMetrics as metrics
 import DnsQuery as query
 import DnsResponse as response
+import DnsResult as dns_result
+import DnsRtt as rtt
+
+# query types supported by the client
+QTYPES = {"A": 0x0001, "NS": 0x0002, "MX": 0x000F}
+
+# query types that can be looked up at once for a name (-types)
+FANOUT_QTYPES = dict(QTYPES, CNAME=0x0005)
 
 
 class CustomArgumentParser(argparse.ArgumentParser):
@@ -13,12 +27,6 @@ class CustomArgumentParser(argparse.ArgumentParser):
 
 def init_args():
 
-    # error handling: ensure correct syntax for args.server (starts with @)
-    def ensure_at(value, argument):
-        if not value.startswith("@"):
-            raise argparse.ArgumentTypeError(f"Argument {argument} must start with @")
-        return value
-
     # error handling: ensure correct syntax for args.timeout and args.retries (positive int)
     def ensure_positive(value, argument):
         try:
@@ -31,6 +39,16 @@ def init_args():
             raise argparse.ArgumentTypeError(f"Argument {argument} must be an integer")
         return value
 
+    # error handling: ensure correct syntax for args.qtypes (comma-separated types)
+    def ensure_qtypes(value):
+        names = [name.strip().upper() for name in value.split(",") if name.strip()]
+        if not names or any(name not in FANOUT_QTYPES for name in names):
+            raise argparse.ArgumentTypeError(
+                f"Argument types must be a comma-separated list of "
+                f"{', '.join(FANOUT_QTYPES)}"
+            )
+        return list(dict.fromkeys(FANOUT_QTYPES[name] for name in names))
+
     """parse the command line arguments (stdin)"""
     # create a parser
     parser = CustomArgumentParser(
@@ -51,13 +69,32 @@ def init_args():
         dest="retries",
     )
     parser.add_argument("-p", type=int, default=53, dest="port")
+    parser.add_argument("-f", type=str, default=None, dest="file")
+    parser.add_argument("-c", type=str, default=None, dest="cache_file")
+    parser.add_argument(
+        "-e",
+        type=lambda val: ensure_positive(val, "EDNS payload size"),
+        default=None,
+        dest="edns",
+    )
+    parser.add_argument(
+        "-w",
+        type=lambda val: ensure_positive(val, "window"),
+        default=100,
+        dest="window",
+    )
+    parser.add_argument("-i", action="store_true", default=False, dest="iterative")
+    parser.add_argument(
+        "-o", choices=["text", "json", "jsonl"], default="text", dest="output"
+    )
+    parser.add_argument("-M", type=str, default=None, dest="metrics")
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-mx", action="store_true", default=False)
     group.add_argument("-ns", action="store_true", default=False)
+    group.add_argument("-types", type=ensure_qtypes, default=None, dest="qtypes")
 
-    # required, positional arguments
-    parser.add_argument("server", type=lambda val: ensure_at(val, "server"))
-    parser.add_argument("name", type=str)
+    # required, positional arguments: one or more @server (optional with -i), then the name
+    parser.add_argument("targets", type=str, nargs="*")
 
     # parse the arguments with the previously defined parser
     args = None
@@ -66,50 +103,73 @@ def init_args():
     except SystemExit as error:
         raise
 
-    args.server = args.server[1:]  # truncate the @
+    # error handling: ensure correct syntax for the servers (start with @)
+    args.servers = []
+    while args.targets and args.targets[0].startswith("@"):
+        args.servers.append(args.targets.pop(0)[1:])  # truncate the @
+    if not args.servers and not args.iterative:
+        parser.error("Argument server must start with @")
+    if len(args.targets) > 1:
+        parser.error(f"Unrecognized arguments: {' '.join(args.targets[1:])}")
+    args.name = args.targets[0] if args.targets else None
+    args.server = args.servers[0] if args.servers else "root servers"
+
+    # error handling: exactly one of name or -f (bulk mode) must be given
+    if (args.name is None) == (args.file is None):
+        parser.error("Exactly one of name or -f must be given")
+    if args.qtypes is not None and args.file is not None:
+        parser.error("Argument -types cannot be used with -f")
 
     return args
 
 
+def format_dns_record(record, aa):
+
+    # check if response received is authoritative
+    auth = "nonauth"
+    if aa:
+        auth = "auth"
+
+    # format answer / additional record according to rtype
+    if record.rtype == 0x0001:
+        return f"IP\t{record.rdata_text()}\t{record.ttl}\t{auth}"
+    elif record.rtype == 0x0002:
+        return f"NS\t{record.rdata}\t{record.ttl}\t{auth}"
+    elif record.rtype == 0x0005:
+        return f"CNAME\t{record.rdata}\t{record.ttl}\t{auth}"
+    elif record.rtype == 0x000F:
+        return f"MX\t{record.rdata}\t{record.preference}\t{record.ttl}\t{auth}"
+    return None
+
+
 def print_dns_response_answer(count, aa, records):
 
-    for i in range(count):
-
-        # check if response received is authoritative
-        auth = "nonauth"
-        if aa:
-            auth = "auth"
-
-        # print answer / additional record according to rtype
-        if records[i]["rtype"] == 0x0001:
-            print(f"IP\t{records[i]["rdata"]}\t{records[i]["ttl"]}\t{auth}")
-        elif records[i]["rtype"] == 0x0002:
-            print(f"NS\t{records[i]["rdata"]}\t{records[i]["ttl"]}\t{auth}")
-        elif records[i]["rtype"] == 0x0005:
-            print(f"CNAME\t{records[i]["rdata"]}\t{records[i]["ttl"]}\t{auth}")
-        elif records[i]["rtype"] == 0x000F:
-            print(
-                f"MX\t{records[i]["rdata"]}\t{records[i]["rdata_preference"]}\t{records[i]["ttl"]}\t{auth}"
-            )
+    # records of unsupported types (e.g. the EDNS0 OPT record) are not decoded,
+    # so there can be fewer records than count
+    for record in records[:count]:
+        line = format_dns_record(record, aa)
+        if line is not None:
+            print(line)
 
 
 def print_dns_response(dns_response):
 
     # Display records in the Answer section
-    if dns_response.header["ancount"] > 0:
-        print(f"***Answer Section ({dns_response.header["ancount"]} records)***")
+    if dns_response.header.ancount > 0:
+        print(f"***Answer Section ({dns_response.header.ancount} records)***")
     print_dns_response_answer(
-        dns_response.header["ancount"],
-        dns_response.header["flags"]["aa"],
+        dns_response.header.ancount,
+        dns_response.header.aa,
         dns_response.answers,
     )
 
     # Display records in the Additional section
-    if dns_response.header["arcount"] > 0:
-        print(f"***Additional Section ({dns_response.header["arcount"]} records)***")
+    # (without the EDNS0 OPT pseudo-record, which is not decoded)
+    if len(dns_response.additional) > 0:
+        print(f"***Additional Section ({len(dns_response.additional)} records)***")
     print_dns_response_answer(
-        dns_response.header["arcount"],
-        dns_response.header["flags"]["aa"],
+        len(dns_response.additional),
+        dns_response.header.aa,
         dns_response.additional,
     )
 
@@ -125,104 +185,517 @@ def print_error(error_message, error_type="other"):
         print(f"ERROR\t{error_message}")
 
 
-def main():
+def open_cache_file(path):
+    # persistent cache file, None (the error printed) if it cannot be opened
+    try:
+        return cache_file.PersistentDnsCache(path)
+    except (OSError, ValueError) as error:  # e.g. not a cache file
+        print_error(error)
+        return None
+
+
+def print_json(args, result):
+    # one indented document (json) or one line (jsonl)
+    print(json.dumps(result, indent=2 if args.output == "json" else None))
+
+
+def write_metrics(path, resolver_metrics):
     """
-    Parse the command line arguments (STDIN)
+    Writes the metrics in the Prometheus text format to a file (- for stdout)
     """
-    args = init_args()
+    if path == "-":
+        print(resolver_metrics.render(), end="")
+    else:
+        with open(path, "w") as file:
+            file.write(resolver_metrics.render())
+
 
+def read_bulk_questions(file, default_qtype):
     """
-    Build DNS query
+    Yields (name, qtype) pairs from a file with one "name [A|NS|MX]" per line.
+    Blank lines and lines starting with # are skipped.
     """
-    if args.mx:
-        qtype = 0x000F
-    elif args.ns:
-        qtype = 0x0002
-    else:
-        qtype = 0x0001
+    for line in file:
+        fields = line.split()
+        if not fields or fields[0].startswith("#"):
+            continue
 
-    dns_query = query.DnsQuery(args.name, qtype)
+        qtype = default_qtype
+        if len(fields) > 1:
+            qtype = QTYPES.get(fields[1].upper())
+            if qtype is None:
+                print_error(f"Unsupported query type {fields[1]} for {fields[0]}")
+                continue
 
-    # error handling: scan through dns_query to find errors
-    # ensure query QR flag is 0
-    if dns_query.header.qr != 0:
-        print_error("Unexpected query: Query QR flag is not set to 0")
-        return
+        yield fields[0], qtype
 
+
+def percentile(sorted_values, percent):
     """
-    Send DNS query
+    Returns the nearest-rank percentile of an already sorted list
     """
-    # summarize dns query that has been sent
-    print(f"DnsClient sending request for {args.name}")
-    print(f"Server: {args.server}")
-    if args.mx:
-        qtype = "MX"
-    elif args.ns:
-        qtype = "NS"
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(percent / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[rank]
+
+
+async def bulk_query(args, file, default_qtype, resolver_metrics):
+    """
+    Resolves every question of the file over one multiplexed UDP socket per
+    server, keeping at most args.window queries in flight and printing each
+    result as soon as it completes. With several servers, each query is raced
+    across them. With -i, names are resolved iteratively, sharing the
+    delegations learned.
+    """
+    questions = read_bulk_questions(file, default_qtype)
+    queries = 0  # questions resolved, each counted once
+    latencies = []  # of the queries answered, failed or not
+    failures = 0
+    results = []  # results of the queries, printed at the end in json output
+    if args.cache_file is not None:
+        dns_cache = open_cache_file(args.cache_file)
+        if dns_cache is None:
+            return
     else:
-        qtype = "A"
-    print(f"Request type: {qtype}")
+        dns_cache = cache.DnsCache()
+
+    async with dns_result.new_resolver(args, dns_cache, args.window) as resolver:
+
+        # each worker pulls the next question once its previous one completed
+        async def worker():
+            nonlocal queries, failures
+            for name, qtype in questions:
+                queries += 1
+                start_time = time.perf_counter()
+                server = None
+                retries = None  # known once a response is received
+                try:
+                    if args.iterative:
+                        dns_response, retries = await resolver.query(name, qtype)
+                    else:
+                        dns_response, retries, server = await resolver.race(name, qtype)
+                    answers = dns_response.answers
+                # no response, or a malformed one
+                except (OSError, ValueError) as error:
+                    latency = time.perf_counter() - start_time
+                    failures += 1
+                    if retries is None:
+                        retries = dns_result.failed_retries(args, error)
+                        attempts = dns_result.failed_attempts(args, error)
+                    else:
+                        attempts = retries + 1
+                    resolver_metrics.observe_failure(latency, retries, error)
+                    if args.output == "text":
+                        print(f"{name}\tERROR\t{error}")
+                    else:
+                        result = dns_result.query_result(
+                            name, qtype, server, latency, attempts, None, args, error
+                        )
+                        results.append(result)
+                        if args.output == "jsonl":
+                            print_json(args, result)
+                    continue
+                latency = time.perf_counter() - start_time
+                latencies.append(latency)
+                resolver_metrics.observe_response(latency, retries, dns_response)
+
+                error_message = dns_result.response_error(
+                    dns_response, not args.iterative
+                )
+                if args.output != "text":
+                    # a racing resolver answers from its cache without a server
+                    attempts = retries + 1
+                    if server is None and not args.iterative:
+                        server, attempts = "cache", 0
+                    result = dns_result.query_result(
+                        name, qtype, server, latency, attempts, dns_response, args
+                    )
+                    if result["status"] == "ERROR":
+                        failures += 1
+                    results.append(result)
+                    if args.output == "jsonl":
+                        print_json(args, result)
+                    continue
+
+                if error_message is not None:
+                    failures += 1
+                    print(f"{name}\tERROR\t{error_message}")
+                elif dns_response.header.rcode == 3:
+                    print(f"{name}\tNOTFOUND")
+                else:
+                    aa = dns_response.header.aa
+                    for record in answers:
+                        line = format_dns_record(record, aa)
+                        if line is not None:
+                            print(f"{name}\t{line}")
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.window)))
+        elapsed = time.perf_counter() - start_time
+
+    resolver_metrics.observe_cache(dns_cache.hits, dns_cache.misses)
+    if args.cache_file is not None:
+        dns_cache.close()
+
+    # summarize the throughput and latency of the bulk query
+    latencies.sort()
+    total = queries
+    if args.output != "text":
+        summary = {
+            "queries": total,
+            "failed": failures,
+            "elapsed_s": round(elapsed, 6),
+            "qps": round(total / elapsed, 1) if elapsed > 0 else 0.0,
+            "cache_hits": dns_cache.hits,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50) * 1000, 3),
+                "p95": round(percentile(latencies, 95) * 1000, 3),
+                "p99": round(percentile(latencies, 99) * 1000, 3),
+            },
+        }
+        if args.output == "json":
+            print_json(args, {"results": results, "summary": summary})
+        else:
+            print_json(args, {"summary": summary})
+        return
 
-    # send dns query
-    start_time = time.time()
-    raw_response, retries = dns_query.send(
-        args.server, args.port, args.timeout, args.retries
+    print(f"***Summary ({total} queries, {failures} failed)***")
+    print(f"Elapsed: {elapsed:.5f} seconds")
+    print(f"QPS: {total / elapsed if elapsed > 0 else 0.0:.1f}")
+    print(f"Cache hits: {dns_cache.hits}")
+    print(
+        f"Latency p50/p95/p99: {percentile(latencies, 50) * 1000:.2f}"
+        f"/{percentile(latencies, 95) * 1000:.2f}"
+        f"/{percentile(latencies, 99) * 1000:.2f} ms"
     )
-    end_time = time.time()
 
-    # ensure raw_response is not None
-    if raw_response == None:
-        return
 
+async def resolve_query(args, qtype):
+    """
+    Resolves args.name iteratively (-i) or by racing it across args.servers.
+    Returns the DnsResponse, its number of retries and the server that sent
+    it (None when resolved iteratively).
     """
-    Wait for response to be returned from server
+    async with dns_result.new_resolver(args) as resolver:
+        if args.iterative:
+            dns_response, retries = await resolver.query(args.name, qtype)
+            return dns_response, retries, None
+        return await resolver.race(args.name, qtype)
+
+
+async def resolve_fanout(args, dns_cache):
     """
-    # summarize the performance and content of the response
+    Resolves every type of args.qtypes for args.name at once.
+    Returns the merged FanoutResult.
+    """
+    async with dns_result.new_resolver(args, dns_cache) as resolver:
+        return await fanout.resolve_types(
+            resolver,
+            args.name,
+            args.qtypes,
+            check=lambda dns_response: dns_result.response_error(
+                dns_response, not args.iterative
+            ),
+        )
+
+
+def fanout_and_print(args, dns_cache, resolver_metrics):
+    """
+    Resolves several query types for the name at once (-types), prints
+    their merged records and records their metrics
+    """
+    start_time = time.perf_counter()
+    result = asyncio.run(resolve_fanout(args, dns_cache))
+    latency = time.perf_counter() - start_time
+
+    # error of each query type, whether raised or in its response
+    errors = {}
+    for qtype in result.qtypes:
+        if qtype in result.errors:
+            error = result.errors[qtype]
+            retries = dns_result.failed_retries(args, error)
+            resolver_metrics.observe_failure(latency, retries, error)
+            errors[qtype] = str(error)
+            continue
+        dns_response = result.responses[qtype]
+        resolver_metrics.observe_response(latency, result.retries[qtype], dns_response)
+        error_message = dns_result.response_error(dns_response, not args.iterative)
+        if error_message is not None:
+            errors[qtype] = error_message
+    if dns_cache is not None:
+        resolver_metrics.observe_cache(dns_cache.hits, dns_cache.misses)
+
+    retries = sum(result.retries.values()) + result.target_retries
+    if len(errors) == len(result.qtypes):
+        status = "ERROR"
+    elif result.not_found:
+        status = "NOTFOUND"
+    else:
+        status = "OK"
+
+    # machine-readable output
+    if args.output != "text":
+        output = {
+            "name": args.name,
+            "qtypes": [dns_result.RTYPE_NAMES[qtype] for qtype in result.qtypes],
+            "server": args.server,
+            "latency_ms": round(latency * 1000, 3),
+            "retries": retries,
+            "extra_lookups": result.extra_lookups,
+            "status": status,
+            "authoritative": result.authoritative,
+            "answers": [dns_result.record_result(r) for r in result.answers],
+            "additional": [dns_result.record_result(r) for r in result.additional],
+            "errors": {
+                dns_result.RTYPE_NAMES[qtype]: errors[qtype] for qtype in errors
+            },
+        }
+        print_json(args, output)
+        return
+
     print(
-        f"Response received after {(end_time - start_time):.5f} seconds ({args.retries - retries} retries)"
+        f"Responses received after {latency:.5f} seconds ({retries} retries, "
+        f"{result.extra_lookups} extra lookups)"
     )
+    for qtype, error_message in errors.items():
+        print_error(f"{dns_result.RTYPE_NAMES[qtype]} query: {error_message}")
+    for target, error in result.target_errors.items():
+        print_error(f"A lookup of {target}: {error}")
+    if status == "NOTFOUND":
+        print(f"NOTFOUND")
+        return
 
+    # merged records of every response
+    aa = result.authoritative
+    if result.answers:
+        print(f"***Answer Section ({len(result.answers)} records)***")
+    print_dns_response_answer(len(result.answers), aa, result.answers)
+    if result.additional:
+        print(f"***Additional Section ({len(result.additional)} records)***")
+    print_dns_response_answer(len(result.additional), aa, result.additional)
+
+
+def resolve_and_print(args, dns_query, dns_cache, resolver_metrics):
     """
-    Interprete DNS response
+    Resolves the query (from the persistent cache file if given and fresh,
+    names not found being cached too),
+    prints the result and records its metrics
     """
-    dns_response = response.DnsResponse(raw_response)
+    text = args.output == "text"
+    qtype = dns_query.question.qtype
+
+    # answer from the persistent cache file, if given and fresh
+    if dns_cache is not None:
+        start_time = time.perf_counter()
+        cached_response = dns_cache.get(args.name, qtype)
+        latency = time.perf_counter() - start_time
+        resolver_metrics.observe_cache(
+            int(cached_response is not None), int(cached_response is None)
+        )
+        if cached_response is not None:
+            resolver_metrics.observe_response(latency, 0, cached_response)
+            if text:
+                print(
+                    f"Response received from cache after {latency:.5f} seconds (0 retries)"
+                )
+                # negative responses are cached too (RFC 2308)
+                if cached_response.header.rcode == 3:
+                    print(f"NOTFOUND")
+                else:
+                    print_dns_response(cached_response)
+            else:
+                print_json(
+                    args,
+                    dns_result.query_result(
+                        args.name, qtype, "cache", latency, 0, cached_response, args
+                    ),
+                )
+            return
+
+    # iterative resolution, several servers to race the query across,
+    # or json output (errors are raised rather than printed)
+    start_time = time.perf_counter()
+    if args.iterative or len(args.servers) > 1 or not text:
+        try:
+            dns_response, retries, server = asyncio.run(resolve_query(args, qtype))
+        except (OSError, ValueError) as error:
+            latency = time.perf_counter() - start_time
+            retries = dns_result.failed_retries(args, error)
+            resolver_metrics.observe_failure(latency, retries, error)
+            if text:
+                print_error(error)
+            else:
+                print_json(
+                    args,
+                    dns_result.query_result(
+                        args.name,
+                        qtype,
+                        None,
+                        latency,
+                        dns_result.failed_attempts(args, error),
+                        None,
+                        args,
+                        error,
+                    ),
+                )
+            return
+        latency = time.perf_counter() - start_time
+
+        if text:
+            source = "" if server is None else f" from {server}"
+            print(
+                f"Response received{source} after {latency:.5f} seconds ({retries} retries)"
+            )
+
+    # single server: send dns query
+    else:
+        raw_response, retries_left = dns_query.send(
+            args.server, args.port, args.timeout, args.retries, rtt=rtt.RttTable()
+        )
+        latency = time.perf_counter() - start_time
+
+        # ensure raw_response is not None
+        if raw_response == None:
+            print_error(args.retries, "maxretries")
+            resolver_metrics.observe_failure(
+                latency, args.retries - 1, TimeoutError("Maximum number of retries")
+            )
+            return
+
+        """
+        Wait for response to be returned from server
+        """
+        # summarize the performance and content of the response
+        # (the first transmission is not a retry)
+        retries = args.retries - retries_left - 1
+        print(f"Response received after {latency:.5f} seconds ({retries} retries)")
+
+        """
+        Interprete DNS response
+        """
+        try:
+            dns_response = response.DnsResponse(raw_response)
+        except response.MalformedResponseError as error:  # e.g. no header
+            resolver_metrics.observe_failure(latency, retries, error)
+            print_error(error)
+            return
+
+        # compare id to match up response to request
+        if dns_query.header.id != dns_response.header.id:
+            error = "Query transaction ID does not match response transaction ID"
+            resolver_metrics.observe_failure(latency, retries, ValueError(error))
+            print_error(error, "unexpected")
+            return
+
+    resolver_metrics.observe_response(latency, retries, dns_response)
+
+    # machine-readable output
+    if not text:
+        result = dns_result.query_result(
+            args.name, qtype, server, latency, retries + 1, dns_response, args
+        )
+        print_json(args, result)
+        if result["status"] in ("OK", "NOTFOUND") and dns_cache is not None:
+            dns_cache.put(args.name, qtype, 0x0001, dns_response)
+        return
 
     """
     Error handling: Scan through dns_response to find errors
     If no errors, output result to terminal display (STDOUT)
     """
-    # compare id to match up response to request
-    if dns_query.header.id != dns_response.header["id"]:
-        print_error(
-            "Query transaction ID does not match response transaction ID", "unexpected"
-        )
-    # ensure response QR flag is 1
-    elif dns_response.header["flags"]["qr"] != 1:
-        print_error("Response QR flag is not set to 1", "unexpected")
-    # ensure response RA flag is 1
-    elif dns_response.header["flags"]["ra"] != 1:
-        print_error("Server does not support recursive queries", "unexpected")
-    # check response RCODE flag for errors
-    elif dns_response.header["flags"]["rcode"] == 1:
-        print_error("Format error: The name server was unable to interpret the query")
-    elif dns_response.header["flags"]["rcode"] == 2:
-        print_error(
-            "Server failure: The name server was unable to process this query due to a problem with the name server"
-        )
-    elif dns_response.header["flags"]["rcode"] == 3:
+    # ensure response QR and RA flags are 1 and check RCODE flag for errors
+    if dns_result.response_error(dns_response, not args.iterative) is not None:
+        print_error(dns_result.response_error(dns_response, not args.iterative))
+    elif dns_response.header.rcode == 3:
         print(f"NOTFOUND")
-    elif dns_response.header["flags"]["rcode"] == 4:
-        print_error(
-            "Not implemented: The name server does not support the requested kind of query"
-        )
-    elif dns_response.header["flags"]["rcode"] == 5:
-        print_error(
-            "Refused: The name server refuses to perform the requested operation for policy reasons"
-        )
+        # remember the name does not exist for the SOA minimum TTL
+        if dns_cache is not None:
+            dns_cache.put(args.name, qtype, 0x0001, dns_response)
 
     # if no error, output result to terminal display (STDOUT)
     else:
-        print_dns_response(dns_response)
+        try:
+            print_dns_response(dns_response)
+        except response.MalformedResponseError as error:
+            print_error(error)
+        else:
+            # store the response for later runs
+            if dns_cache is not None:
+                dns_cache.put(args.name, qtype, 0x0001, dns_response)
+
+
+def main():
+    """
+    Parse the command line arguments (STDIN)
+    """
+    args = init_args()
+    resolver_metrics = metrics.ResolverMetrics()
+
+    """
+    Bulk mode: read names from a file (or stdin for -)
+    """
+    if args.file is not None:
+        default_qtype = QTYPES["MX" if args.mx else "NS" if args.ns else "A"]
+        if args.file == "-":
+            asyncio.run(bulk_query(args, sys.stdin, default_qtype, resolver_metrics))
+        else:
+            with open(args.file) as file:
+                asyncio.run(bulk_query(args, file, default_qtype, resolver_metrics))
+        if args.metrics is not None:
+            write_metrics(args.metrics, resolver_metrics)
+        return
+
+    """
+    Build DNS query
+    """
+    if args.mx:
+        qtype = 0x000F
+    elif args.ns:
+        qtype = 0x0002
+    else:
+        qtype = 0x0001
+
+    dns_query = query.DnsQuery(args.name, qtype, edns_payload_size=args.edns)
+
+    # error handling: scan through dns_query to find errors
+    # ensure query QR flag is 0
+    if dns_query.header.qr != 0:
+        print_error("Unexpected query: Query QR flag is not set to 0")
+        return
+
+    """
+    Send DNS query
+    """
+    # summarize dns query that has been sent
+    if args.output == "text":
+        print(f"DnsClient sending request for {args.name}")
+        print(f"Server: {', '.join(args.servers) or args.server}")
+        if args.qtypes is not None:
+            qtype = ", ".join(dns_result.RTYPE_NAMES[qtype] for qtype in args.qtypes)
+        elif args.mx:
+            qtype = "MX"
+        elif args.ns:
+            qtype = "NS"
+        else:
+            qtype = "A"
+        print(f"Request type: {qtype}")
+
+    dns_cache = None
+    if args.cache_file is not None:
+        dns_cache = open_cache_file(args.cache_file)
+        if dns_cache is None:
+            return
+    try:
+        if args.qtypes is not None:
+            fanout_and_print(args, dns_cache, resolver_metrics)
+        else:
+            resolve_and_print(args, dns_query, dns_cache, resolver_metrics)
+    finally:
+        if dns_cache is not None:
+            dns_cache.close()
+        if args.metrics is not None:
+            write_metrics(args.metrics, resolver_metrics)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,332 @@
+import argparse
+import json
+import os
+import random
+import struct
+import time
+import tracemalloc
+import DnsResponse as response
+import dnsClient as client
+
+# kinds of synthetic packets and their share of a generated corpus
+PACKET_KINDS = {
+    "a": 0.35,
+    "cname": 0.15,
+    "mx": 0.15,
+    "referral": 0.15,
+    "compression": 0.1,
+    "malformed": 0.1,
+}
+
+
+class PacketBuilder:
+    def __init__(self, transaction_id, flags=0x8180):
+        """
+        Initializes a wire-format response being built with:
+        - data: The packet so far, starting with a header whose counts are set by build
+        - names: Offset of every name suffix already written, for compression
+        - counts: Number of questions and of records of each section
+        """
+        self.data = bytearray(12)
+        self.transaction_id = transaction_id
+        self.flags = flags
+        self.names = {}
+        self.counts = [0, 0, 0, 0]
+
+    def name(self, name):
+        # write a name, pointing at the longest suffix already written
+        labels = name.split(".")
+        for i in range(len(labels)):
+            suffix = ".".join(labels[i:])
+            if suffix in self.names:
+                self.data += struct.pack(">H", 0xC000 | self.names[suffix])
+                return
+            if len(self.data) < 0x3FFF:
+                self.names[suffix] = len(self.data)
+            label = labels[i].encode("utf-8")
+            self.data.append(len(label))
+            self.data += label
+        self.data.append(0)
+
+    def question(self, name, qtype):
+        self.name(name)
+        self.data += struct.pack(">HH", qtype, 1)
+        self.counts[0] += 1
+
+    def record(self, section, name, rtype, rdata, ttl=3600, preference=None):
+        """
+        Writes a record of a section (1: answer, 2: authority, 3: additional),
+        rdata being an IPv4 address for A records, else a domain name
+        """
+        self.name(name)
+        self.data += struct.pack(">HHI", rtype, 1, ttl)
+        length_offset = len(self.data)
+        self.data += b"\x00\x00"
+        if rtype == 0x0001:
+            self.data += bytes(int(part) for part in rdata.split("."))
+        else:
+            if preference is not None:
+                self.data += struct.pack(">H", preference)
+            self.name(rdata)
+        rdlength = len(self.data) - length_offset - 2
+        struct.pack_into(">H", self.data, length_offset, rdlength)
+        self.counts[section] += 1
+
+    def build(self):
+        struct.pack_into(
+            ">HHHHHH", self.data, 0, self.transaction_id, self.flags, *self.counts
+        )
+        return bytes(self.data)
+
+
+def random_address(rng):
+    return f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+
+
+def random_domain(rng):
+    return f"example{rng.randrange(1000)}.{rng.choice(['com', 'net', 'org', 'ca'])}"
+
+
+def generate_packet(rng, kind):
+    """
+    Generates a synthetic response of the given kind
+    """
+    builder = PacketBuilder(rng.randrange(65536))
+    domain = random_domain(rng)
+
+    if kind == "a":
+        name = f"www{rng.randrange(100)}.{domain}"
+        builder.question(name, 0x0001)
+        for _ in range(rng.randint(1, 8)):
+            builder.record(1, name, 0x0001, random_address(rng), 300)
+
+    elif kind == "cname":
+        name = f"alias.{domain}"
+        builder.question(name, 0x0001)
+        for hop in range(rng.randint(1, 4)):
+            target = f"cdn{hop}.edge{rng.randrange(50)}.{random_domain(rng)}"
+            builder.record(1, name, 0x0005, target, 60)
+            name = target
+        builder.record(1, name, 0x0001, random_address(rng), 60)
+
+    elif kind == "mx":
+        builder.question(domain, 0x000F)
+        exchanges = [f"mx{i}.mail.{domain}" for i in range(rng.randint(2, 5))]
+        for i, exchange in enumerate(exchanges):
+            builder.record(1, domain, 0x000F, exchange, 3600, preference=10 * (i + 1))
+        for exchange in exchanges:
+            builder.record(3, exchange, 0x0001, random_address(rng))
+
+    elif kind == "referral":
+        # delegation with every nameserver's glue, like a root or TLD referral
+        builder.flags = 0x8000
+        builder.question(f"www.{domain}", 0x0001)
+        tld = domain.split(".")[-1]
+        nameservers = [f"{chr(97 + i)}.gtld-servers.net" for i in range(13)]
+        for nameserver in nameservers:
+            builder.record(2, tld, 0x0002, nameserver, 172800)
+        for nameserver in nameservers:
+            builder.record(3, nameserver, 0x0001, random_address(rng), 172800)
+
+    elif kind == "compression":
+        # many long names sharing suffixes, each mostly a compression pointer
+        base = ".".join(f"l{i}" for i in range(rng.randint(8, 20))) + "." + domain
+        builder.question(base, 0x0002)
+        for i in range(rng.randint(10, 30)):
+            builder.record(1, base, 0x0002, f"ns{i}.sub{i % 3}.{base}", 3600)
+
+    else:
+        return malformed_packet(rng)
+
+    return builder.build()
+
+
+def malformed_packet(rng):
+    """
+    Generates a response that is truncated, has a compression pointer loop
+    or a reserved label type
+    """
+    defect = rng.choice(["truncated", "loop", "label"])
+    if defect == "truncated":
+        packet = generate_packet(rng, rng.choice(["a", "mx", "referral"]))
+        return packet[: rng.randint(12, len(packet) - 1)]
+
+    builder = PacketBuilder(rng.randrange(65536))
+    builder.question(random_domain(rng), 0x0001)
+    packet = bytearray(builder.data)
+    if defect == "loop":
+        # answer name pointing at itself
+        packet += struct.pack(">H", 0xC000 | len(packet))
+    else:
+        packet += b"\x45abc\x00"  # label length 0x45 is a reserved type
+    packet += struct.pack(">HHIH", 1, 1, 300, 4) + bytes(4)
+    struct.pack_into(">HHHHHH", packet, 0, builder.transaction_id, 0x8180, 1, 1, 0, 0)
+    return bytes(packet)
+
+
+def generate_corpus(count, seed):
+    """
+    Generates count synthetic responses with the shares of PACKET_KINDS
+    """
+    rng = random.Random(seed)
+    kinds = list(PACKET_KINDS)
+    weights = list(PACKET_KINDS.values())
+    return [generate_packet(rng, rng.choices(kinds, weights)[0]) for _ in range(count)]
+
+
+def write_corpus(path, packets):
+    # every packet is prefixed by its 2-byte length, as over TCP
+    with open(path, "wb") as file:
+        for packet in packets:
+            file.write(struct.pack(">H", len(packet)) + packet)
+
+
+def read_corpus(path):
+    with open(path, "rb") as file:
+        data = file.read()
+
+    packets = []
+    offset = 0
+    while offset + 2 <= len(data):
+        length = struct.unpack_from(">H", data, offset)[0]
+        packets.append(data[offset + 2 : offset + 2 + length])
+        offset += 2 + length
+    return packets
+
+
+def parse(packet):
+    """
+    Fully decodes a response (header, question and every section).
+    Returns the parsed response, None if it is malformed.
+    """
+    try:
+        dns_response = response.DnsResponse(packet)
+        dns_response.question
+        dns_response.answers
+        dns_response.authority
+        dns_response.additional
+    except response.MalformedResponseError:
+        return None
+    return dns_response
+
+
+def measure_throughput(packets, iterations):
+    """
+    Parses the corpus iterations times in a tight loop.
+    Returns the elapsed time and the number of malformed packets of the corpus.
+    """
+    malformed = sum(parse(packet) is None for packet in packets)
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        for packet in packets:
+            parse(packet)
+    return time.perf_counter() - start_time, malformed
+
+
+def measure_allocations(packets):
+    """
+    Returns, per packet, the memory blocks and bytes still held by its parsed
+    response once parsed (snapshot difference) and the peak memory allocated
+    while parsing it, temporaries included (peak minus baseline), traced by
+    tracemalloc
+    """
+    parsed = [None] * len(packets)  # allocated up front, outside the traces
+    peak_size = 0
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for index, packet in enumerate(packets):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        parsed[index] = parse(packet)
+        peak_size += tracemalloc.get_traced_memory()[1] - baseline
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    # leave out the snapshots themselves
+    ignore_tracemalloc = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    before = before.filter_traces(ignore_tracemalloc)
+    after = after.filter_traces(ignore_tracemalloc)
+    differences = after.compare_to(before, "filename")
+    blocks = sum(difference.count_diff for difference in differences)
+    size = sum(difference.size_diff for difference in differences)
+    del parsed
+    return blocks / len(packets), size / len(packets), peak_size / len(packets)
+
+
+def init_args():
+
+    # error handling: ensure correct syntax for the integer arguments (positive int)
+    def ensure_positive(value, argument):
+        try:
+            value = int(value)
+            if value <= 0:
+                raise argparse.ArgumentTypeError(
+                    f"Argument {argument} must be strictly positive"
+                )
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Argument {argument} must be an integer")
+        return value
+
+    """parse the command line arguments (stdin)"""
+    parser = client.CustomArgumentParser(allow_abbrev=False)
+    parser.add_argument(
+        "-g",
+        type=lambda val: ensure_positive(val, "generated packets"),
+        default=None,
+        dest="generate",
+    )
+    parser.add_argument("-s", type=int, default=316, dest="seed")
+    parser.add_argument(
+        "-i",
+        type=lambda val: ensure_positive(val, "iterations"),
+        default=20,
+        dest="iterations",
+    )
+    parser.add_argument("corpus", type=str)
+
+    args = parser.parse_args()
+
+    # error handling: the corpus must exist unless it is generated
+    if args.generate is None and not os.path.exists(args.corpus):
+        parser.error(f"Corpus {args.corpus} does not exist, generate it with -g")
+    return args
+
+
+def main():
+    """
+    Generates the corpus file (with -g) then benchmarks the parser over it,
+    printing the results as JSON
+    """
+    args = init_args()
+    if args.generate is not None:
+        write_corpus(args.corpus, generate_corpus(args.generate, args.seed))
+
+    packets = read_corpus(args.corpus)
+    if not packets:
+        client.print_error(f"Corpus {args.corpus} holds no packet")
+        return
+
+    total_bytes = sum(len(packet) for packet in packets)
+    elapsed, malformed = measure_throughput(packets, args.iterations)
+    blocks, size, peak_size = measure_allocations(packets)
+
+    parsed_packets = len(packets) * args.iterations
+    results = {
+        "corpus": args.corpus,
+        "packets": len(packets),
+        "malformed": malformed,
+        "mean_packet_bytes": round(total_bytes / len(packets), 1),
+        "iterations": args.iterations,
+        "elapsed_s": round(elapsed, 6),
+        "packets_per_s": round(parsed_packets / elapsed, 1),
+        "bytes_per_s": round(total_bytes * args.iterations / elapsed, 1),
+        "us_per_packet": round(elapsed / parsed_packets * 1e6, 3),
+        "retained_blocks_per_packet": round(blocks, 1),
+        "retained_bytes_per_packet": round(size, 1),
+        "peak_bytes_per_parse": round(peak_size, 1),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import DnsAsyncResolver as async_resolver
+import DnsCache as cache
+import DnsForwarder as forwarder
+import DnsPrefetch as prefetch
+import DnsRtt as rtt
+import dnsClient as client
+
+
+def init_args():
+
+    # error handling: ensure correct syntax for the integer arguments (positive int)
+    def ensure_positive(value, argument):
+        try:
+            value = int(value)
+            if value <= 0:
+                raise argparse.ArgumentTypeError(
+                    f"Argument {argument} must be strictly positive"
+                )
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Argument {argument} must be an integer")
+        return value
+
+    # error handling: ensure correct syntax for the prefetch arguments (positive float)
+    def ensure_non_negative(value, argument, maximum=None):
+        try:
+            value = float(value)
+            if value < 0 or (maximum is not None and value > maximum):
+                raise argparse.ArgumentTypeError(
+                    f"Argument {argument} must be between 0 and {maximum}"
+                    if maximum is not None
+                    else f"Argument {argument} must be positive"
+                )
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Argument {argument} must be a number")
+        return value
+
+    """parse the command line arguments (stdin)"""
+    parser = client.CustomArgumentParser(allow_abbrev=False)
+
+    # optional arguments
+    parser.add_argument("-b", type=str, default="127.0.0.1", dest="address")
+    parser.add_argument(
+        "-l",
+        type=lambda val: ensure_positive(val, "listen port"),
+        default=5353,
+        dest="listen_port",
+    )
+    parser.add_argument(
+        "-t",
+        type=lambda val: ensure_positive(val, "timeout"),
+        default=5,
+        dest="timeout",
+    )
+    parser.add_argument(
+        "-r",
+        type=lambda val: ensure_positive(val, "retries"),
+        default=3,
+        dest="retries",
+    )
+    parser.add_argument("-p", type=int, default=53, dest="port")
+    parser.add_argument("-c", type=str, default=None, dest="cache_file")
+    parser.add_argument(
+        "-e",
+        type=lambda val: ensure_positive(val, "EDNS payload size"),
+        default=4096,
+        dest="edns",
+    )
+    parser.add_argument(
+        "-s",
+        type=lambda val: ensure_positive(val, "statistics interval"),
+        default=10,
+        dest="interval",
+    )
+    parser.add_argument(
+        "-P",
+        type=lambda val: ensure_non_negative(val, "prefetch fraction", 1),
+        default=prefetch.PREFETCH_FRACTION,
+        dest="prefetch_fraction",
+    )
+    parser.add_argument(
+        "-R",
+        type=lambda val: ensure_non_negative(val, "prefetch rate"),
+        default=prefetch.PREFETCH_RATE,
+        dest="prefetch_rate",
+    )
+
+    # required, positional arguments: the upstream servers
+    parser.add_argument("servers", type=str, nargs="+")
+
+    args = parser.parse_args()
+
+    # error handling: ensure correct syntax for the servers (start with @)
+    if not all(server.startswith("@") for server in args.servers):
+        parser.error("Argument server must start with @")
+    args.servers = [server[1:] for server in args.servers]  # truncate the @
+
+    return args
+
+
+def print_statistics(dns_forwarder):
+    queries, qps, hit_rate = dns_forwarder.statistics()
+    print(
+        f"{queries} queries, {qps:.1f} QPS, {hit_rate:.1%} cache hits, "
+        f"{dns_forwarder.failures} upstream failures, "
+        f"{dns_forwarder.resolver.coalesced} coalesced"
+    )
+    prefetcher = dns_forwarder.prefetcher
+    if prefetcher is not None:
+        print(
+            f"{prefetcher.prefetches} prefetches, {prefetcher.rate_limited} "
+            f"rate-limited, {prefetcher.failures} failed"
+        )
+
+
+async def serve(args):
+    """
+    Forwards the queries received on the listening port to the upstream
+    servers, printing statistics every args.interval seconds
+    """
+    if args.cache_file is not None:
+        dns_cache = client.open_cache_file(args.cache_file)
+        if dns_cache is None:
+            return
+    else:
+        dns_cache = cache.DnsCache()
+
+    # refresh the hot answers ahead of their expiry (disabled by -P 0)
+    prefetcher = None
+    if args.prefetch_fraction > 0 and args.prefetch_rate > 0:
+        prefetcher = prefetch.Prefetcher(
+            dns_cache, args.prefetch_fraction, args.prefetch_rate
+        )
+
+    async with async_resolver.RacingResolver(
+        args.servers,
+        args.port,
+        args.timeout,
+        args.retries,
+        rtt=rtt.RttTable(),
+        edns_payload_size=args.edns,
+    ) as resolver:
+        dns_forwarder = forwarder.DnsForwarder(resolver, dns_cache, prefetcher)
+        transport, tcp_server = await forwarder.start(
+            dns_forwarder, args.address, args.listen_port
+        )
+        print(
+            f"DnsServer listening on {args.address}:{args.listen_port}, "
+            f"forwarding to {', '.join(args.servers)}"
+        )
+
+        try:
+            while True:
+                await asyncio.sleep(args.interval)
+                print_statistics(dns_forwarder)
+        finally:
+            transport.close()
+            tcp_server.close()
+            print_statistics(dns_forwarder)
+            if args.cache_file is not None:
+                dns_cache.close()
+
+
+def main():
+    args = init_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    except OSError as error:  # e.g. the listening port is already in use
+        client.print_error(error)
+
+
+if __name__ == "__main__":
+    main()
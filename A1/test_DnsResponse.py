@@ -0,0 +1,83 @@
+import random
+import time
+import pytest
+import DnsResponse as response
+import dnsParseBenchmark as parse_benchmark
+
+# packets of each corpus, and the longest any single packet may take to parse
+CORPUS_SIZE = 500
+MAX_PARSE_TIME = 0.05
+
+
+def decode_fully(packet):
+    # decodes everything a client reads from a response
+    dns_response = response.DnsResponse(packet)
+    dns_response.question
+    for section in response.SECTIONS:
+        for record in getattr(dns_response, section):
+            record.rdata_text()
+    dns_response.aged_raw_response(1)
+
+
+def timed_decode(packet):
+    # returns the exception raised decoding the packet (None if it decoded)
+    start_time = time.perf_counter()
+    try:
+        decode_fully(packet)
+        error = None
+    except ValueError as decode_error:  # any other exception fails the test
+        error = decode_error
+    assert time.perf_counter() - start_time < MAX_PARSE_TIME
+    return error
+
+
+def mutated_packet(rng, packet):
+    # a valid response with a few random bytes overwritten, or cut short
+    packet = bytearray(packet)
+    for i in range(rng.randint(1, 4)):
+        packet[rng.randrange(len(packet))] = rng.randrange(256)
+    return bytes(packet[: rng.randint(0, len(packet))])
+
+
+def test_malformed_packets_raise_value_error():
+    rng = random.Random(316)
+    for i in range(CORPUS_SIZE):
+        error = timed_decode(parse_benchmark.malformed_packet(rng))
+        assert isinstance(error, response.MalformedResponseError)
+
+
+def test_mutated_packets_raise_only_value_error():
+    rng = random.Random(316)
+    corpus = parse_benchmark.generate_corpus(CORPUS_SIZE, 316)
+    for packet in corpus:
+        error = timed_decode(mutated_packet(rng, packet))
+        assert error is None or isinstance(error, response.MalformedResponseError)
+
+
+def test_valid_packets_decode():
+    corpus = parse_benchmark.generate_corpus(CORPUS_SIZE, 316)
+    valid = [packet for packet in corpus if parse_benchmark.parse(packet) is not None]
+    assert valid
+    for packet in valid:
+        assert timed_decode(packet) is None
+
+
+@pytest.mark.parametrize(
+    "hops", [1, response.MAX_POINTER_HOPS, response.MAX_POINTER_HOPS + 1]
+)
+def test_pointer_chain_is_bounded(hops):
+    # answer name reached through a chain of compression pointers,
+    # the first in the record and the others after it
+    header = bytes.fromhex("000181800000000100000000")
+    record = bytes.fromhex("0001000100000e1000040a000001")
+    packet = bytearray(header)
+    packet += (0xC000 | (len(packet) + 2 + len(record))).to_bytes(2, "big")
+    packet += record
+    for i in range(hops - 1):
+        packet += (0xC000 | (len(packet) + 2)).to_bytes(2, "big")
+    packet += b"\x01a\x00"
+    error = timed_decode(bytes(packet))
+    if hops > response.MAX_POINTER_HOPS:
+        assert isinstance(error, response.MalformedResponseError)
+    else:
+        assert error is None
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from matplotlib.colors import LogNorm
 import matplotlib.pyplot as plt
 import numpy as np
@@ -8,6 +9,15 @@ import time
 
 # global variables
 BASE_CASE_LENGTH = 16
+PROGRESSIVE_CHUNK_SIZE = 1024  # coefficients per chunk of the progressive stream
+PROGRESSIVE_LEVELS = [1, 2, 5, 10, 25, 100]  # % of coefficients received, mode 5
+# cost of a butterfly of twod_inverse_fft over that of a vectorized multiply-add
+# of the progressive decode, measured on a 512x1024 image
+INVERSE_FFT_COST_RATIO = 9000
+
+# persistent thread pool for the threaded 2D FFT (created on first use)
+thread_pool = None
+thread_pool_size = 0
 
 
 def init_args():
@@ -16,8 +26,9 @@ def init_args():
     parser = argparse.ArgumentParser(allow_abbrev=False)
 
     # optional arguments
-    parser.add_argument("-m", type=int, choices=[1, 2, 3, 4], default=1, dest="mode")
+    parser.add_argument("-m", type=int, choices=[1, 2, 3, 4, 5], default=1, dest="mode")
     parser.add_argument("-i", type=str, default="moonlanding.png", dest="image")
+    parser.add_argument("-t", type=int, default=0, dest="threads")
 
     # parse the arguments with the previously defined parser
     args = None
@@ -118,6 +129,76 @@ def twod_fft(signal_image):
     return fft_final
 
 
+# computes 1D Cooley-Tukey FFT of every row of a 2D array at once
+# (each step is one vectorized NumPy call, which releases the GIL)
+def fft_rows(signal_rows):
+
+    signal_rows = np.asarray(signal_rows, dtype=complex)
+    N = signal_rows.shape[1]  # length of the signals we want to decompose
+
+    """Base case: Naive DFT method, as a matrix product"""
+    if N <= BASE_CASE_LENGTH:
+        n = np.arange(N)
+        dft_matrix = np.exp(-2j * np.pi * np.outer(n, n) / N)
+        return signal_rows @ dft_matrix
+
+    """Inductive case: Cooley-Tukey FFT method"""
+    # recursively call FFT for even and odd columns of all rows
+    fft_even = fft_rows(signal_rows[:, 0::2])
+    fft_odd = fft_rows(signal_rows[:, 1::2])
+
+    # combine odd and even sums back together
+    exponent = np.exp(-2j * np.pi * np.arange(N // 2) / N) * fft_odd
+    return np.concatenate((fft_even + exponent, fft_even - exponent), axis=1)
+
+
+# returns the persistent thread pool, (re)creating it if the size changed
+def get_thread_pool(num_threads):
+    global thread_pool, thread_pool_size
+
+    if thread_pool is None or thread_pool_size != num_threads:
+        if thread_pool is not None:
+            thread_pool.shutdown()
+        thread_pool = ThreadPoolExecutor(max_workers=num_threads)
+        thread_pool_size = num_threads
+
+    return thread_pool
+
+
+# computes 2D Cooley-Tukey FFT, splitting each pass into chunks
+# that run on a persistent thread pool
+def twod_fft_threaded(signal_image, num_threads):
+
+    rows, columns = signal_image.shape
+    pool = get_thread_pool(num_threads)
+
+    # shared output arrays, every thread writes straight into its own slice
+    fft_row = np.empty((rows, columns), dtype=complex)
+    fft_final = np.empty((rows, columns), dtype=complex)
+
+    def fft_row_chunk(start, end):
+        fft_row[start:end, :] = fft_rows(signal_image[start:end, :])
+
+    def fft_column_chunk(start, end):
+        fft_final[:, start:end] = fft_rows(fft_row[:, start:end].T).T
+
+    # run one pass over chunks of [0, length) and wait for all of them
+    def run_pass(chunk_function, length):
+        bounds = np.linspace(0, length, min(num_threads, length) + 1, dtype=int)
+        futures = [
+            pool.submit(chunk_function, start, end)
+            for start, end in zip(bounds[:-1], bounds[1:])
+        ]
+        for future in futures:
+            future.result()  # re-raises any exception from the thread
+
+    # fft on rows, then fft the columns on the fft'ed rows
+    run_pass(fft_row_chunk, rows)
+    run_pass(fft_column_chunk, columns)
+
+    return fft_final
+
+
 # computes naive 1D inverse DFT
 def inverse_dft(signal):
 
@@ -164,12 +245,13 @@ def inverse_fft(signal):
     inverse_fft_final = [0] * N
     for k in range((N // 2)):
         exponent = np.exp(2j * np.pi * k / N)
+        # halved at every level, so the result is divided by N overall
         inverse_fft_final[k] = (
             inverse_fft_even[k] + exponent * inverse_fft_odd[k]
-        )  # first half
+        ) / 2  # first half
         inverse_fft_final[k + N // 2] = (
             inverse_fft_even[k] - exponent * inverse_fft_odd[k]
-        )  # second half
+        ) / 2  # second half
 
     return inverse_fft_final
 
@@ -226,12 +308,18 @@ def crop(original_image, final_image):
 
 
 # MODE 1: computes 2D Cooley-Tukey FFT given an image file path
-def compute_2d_fft(image_path):
+# (on num_threads threads if num_threads > 0)
+def compute_2d_fft(image_path, num_threads=0):
 
     image_original = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)  # get original image
 
     padded_image = pad_image(image_original)  # pad the image so that it's a power of 2
-    fft_final = twod_fft(padded_image)  # compute 2D Cooley-Tukey FFT
+
+    # compute 2D Cooley-Tukey FFT
+    if num_threads > 0:
+        fft_final = twod_fft_threaded(padded_image, num_threads)
+    else:
+        fft_final = twod_fft(padded_image)
 
     return image_original, fft_final
 
@@ -345,6 +433,119 @@ def compress_image_low_high_frequencies(computed_2d_fft, compression_level):
     return np.abs(compressed_image), non_zero_count
 
 
+# MODE 5: progressively encodes a 2D FFT as a stream of chunks,
+# sending the highest magnitude coefficients first
+def progressive_encode(computed_2d_fft, chunk_size=PROGRESSIVE_CHUNK_SIZE):
+
+    # flatten FFT into 1D and sort coefficients by descending magnitude
+    flattened_fft = computed_2d_fft.ravel()
+    order = np.argsort(np.abs(flattened_fft), kind="stable")[::-1]
+
+    # emit (flat indices, coefficients) one chunk at a time
+    for start in range(0, order.size, chunk_size):
+        indices = order[start : start + chunk_size]
+        yield indices, flattened_fft[indices]
+
+
+# MODE 5: progressively decodes a stream of chunks from progressive_encode,
+# yielding the refined reconstruction after every chunk
+def progressive_decode(shape, chunks):
+
+    rows, columns = shape
+
+    # the inverse 2D DFT is linear, so each chunk is added on top of the
+    # current reconstruction (O(MN) per coefficient) instead of redoing the
+    # full inverse transform (O(MN log MN)), unless the chunk is so large
+    # that redoing the inverse of every coefficient received costs less
+    reconstruction = np.zeros((rows, columns), dtype=complex)
+    spectrum = np.zeros((rows, columns), dtype=complex)
+    non_zero_count = 0
+    full_inverse_size = INVERSE_FFT_COST_RATIO * np.log2(rows * columns)
+
+    # precompute twiddle factor tables and the time indices
+    row_twiddles = np.exp(2j * np.pi * np.arange(rows) / rows)
+    column_twiddles = np.exp(2j * np.pi * np.arange(columns) / columns)
+    m = np.arange(rows)
+    n = np.arange(columns)
+
+    for indices, coefficients in chunks:
+        # spectrum of the coefficients received so far, for the full inverse
+        np.put(spectrum, indices, coefficients)
+
+        if indices.size > full_inverse_size:
+            # inverse 2D FFT of the whole spectrum received so far
+            reconstruction[:] = twod_inverse_fft(spectrum)
+        else:
+            # added in blocks, bounding the basis tables to rows x block size
+            for start in range(0, indices.size, PROGRESSIVE_CHUNK_SIZE):
+                block = slice(start, start + PROGRESSIVE_CHUNK_SIZE)
+
+                # recover the 2D frequency indices (k, l) of the block
+                k, l = np.divmod(indices[block], columns)
+
+                # basis vectors of each coefficient: e^(2j*pi*k*m/M) and e^(2j*pi*l*n/N)
+                row_basis = row_twiddles[np.outer(m, k) % rows]  # rows x block
+                column_basis = column_twiddles[np.outer(l, n) % columns]
+
+                # sum of the rank-1 contributions of the block, as one matrix product
+                reconstruction += (
+                    (row_basis * coefficients[block]) @ column_basis / (rows * columns)
+                )
+
+        # count the num of non-zero coefficients received so far
+        non_zero_count += np.count_nonzero(coefficients)
+
+        # the same array is updated in place and yielded after every chunk
+        yield reconstruction, non_zero_count
+
+
+# MODE 5: shows the image as received through the progressive stream,
+# after the given % of coefficients
+def progressive_images(computed_2d_fft, levels=PROGRESSIVE_LEVELS):
+
+    chunks = progressive_encode(computed_2d_fft)
+
+    # number of coefficients received at each level, rounded up
+    boundaries = [-(-level * computed_2d_fft.size // 100) for level in levels]
+
+    # the stream is split at the level boundaries and the coefficients
+    # received between two levels are decoded at once, one image per level
+    def level_chunks():
+        pending = []
+        received = 0
+        boundary = iter(boundaries)
+        next_boundary = next(boundary, None)
+        for indices, coefficients in chunks:
+            # a chunk may end any number of levels
+            while (
+                next_boundary is not None and next_boundary <= received + indices.size
+            ):
+                split = next_boundary - received
+                pending.append((indices[:split], coefficients[:split]))
+                indices, coefficients = indices[split:], coefficients[split:]
+                received = next_boundary
+
+                pending_indices, pending_coefficients = zip(*pending)
+                yield np.concatenate(pending_indices), np.concatenate(
+                    pending_coefficients
+                )
+                pending = []
+                next_boundary = next(boundary, None)
+
+            pending.append((indices, coefficients))
+            received += indices.size
+
+    images = []
+    non_zero_counts = []
+    for reconstruction, non_zero_count in progressive_decode(
+        computed_2d_fft.shape, level_chunks()
+    ):
+        images.append(np.abs(reconstruction))
+        non_zero_counts.append(non_zero_count)
+
+    return images, non_zero_counts
+
+
 # MODE 4: analyze runtime complexity
 
 
@@ -458,7 +659,7 @@ def main():
     else:
         """compute 2D FFT"""
         # compute the 2D FFT of the given image
-        original_image, computed_2d_fft_image = compute_2d_fft(args.image)
+        original_image, computed_2d_fft_image = compute_2d_fft(args.image, args.threads)
 
         """compute program outputs"""
         # MODE 1: Fourier Transform
@@ -557,6 +758,28 @@ def main():
             plt.tight_layout()
             plt.show()
 
+        # MODE 5: Progressive transmission
+        elif args.mode == 5:
+
+            # reconstruct the image as its coefficients are received
+            images, non_zero_counts = progressive_images(computed_2d_fft_image)
+
+            # display the results
+            plt.figure(figsize=(12, 8))
+            for i, (image, level, count) in enumerate(
+                zip(images, PROGRESSIVE_LEVELS, non_zero_counts)
+            ):
+                plt.subplot(2, 3, i + 1)
+                plt.imshow(crop(original_image, image), cmap="gray")
+                plt.title(f"{level}% of Coefficients Received")
+                plt.axis("off")
+
+                # print num of non-zeros to command line
+                print(f"Number of non-zeros after {level}% received: {count}")
+
+            plt.tight_layout()
+            plt.show()
+
 
 if __name__ == "__main__":
     main()
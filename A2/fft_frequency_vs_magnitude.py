@@ -11,7 +11,9 @@ def main():
 
     """compute 2D FFT"""
     # compute the 2D FFT of the given image
-    original_image, computed_2d_fft_image = fft.compute_2d_fft(args.image)
+    original_image, computed_2d_fft_image = fft.compute_2d_fft(
+        args.image, args.threads
+    )
 
     """compute program outputs"""
     # MODE 3: Compression